@@ -0,0 +1,222 @@
+"""
+Thread pool executor finding its number of workers at run time: threads.py
+hard-codes MAX_WORKERS, while the best number depends on the host (its
+latency, how many requests it serves at once, what's in between), see its
+benchmark with 10 vs 20 workers.
+
+The limit of tasks running at once is adapted AIMD-style, as TCP does with
+its congestion window. Every INTERVAL seconds the throughput and the mean
+latency of the tasks completed meanwhile are measured, then:
+- congestion, a task failed, or the latency went over LATENCY_TOLERANCE
+  times the lowest one seen while the throughput didn't improve (requests
+  queue somewhere, more workers only wait more): the limit is multiplied by
+  DECREASE. A latency rising with the throughput is the price of more
+  requests in flight, on a fast host most of it is the client's own work
+- otherwise, if tasks were waiting for a worker and the throughput didn't
+  fall, the limit grows, doubled until the first congestion (slow start),
+  then one worker at a time
+always within [min_workers, max_workers]. max_workers threads are started,
+a gate lets 'limit' of them run tasks at once.
+
+    with AdaptiveExecutor(min_workers=2, max_workers=64) as executor:
+        flags = list(executor.map(download_one, cc_list))
+    executor.report()  # the limit over time
+
+run from command line: python adaptive_executor.py [local [n_flags]
+[latency] [capacity]] (against flags_server.py serving 'capacity' requests
+at once, next to thread_download_many_v1 with fixed numbers of workers)
+"""
+
+import sys
+import threading
+import time
+from concurrent import futures
+from itertools import repeat
+
+import threads
+
+MIN_WORKERS = 2
+MAX_WORKERS = 64
+INTERVAL = 0.5  # seconds between adjustments
+MIN_SAMPLES = 5  # tasks completed before adjusting, however long it takes
+LATENCY_TOLERANCE = 1.5
+THROUGHPUT_TOLERANCE = 0.1  # a fall of less than 10% is noise
+THROUGHPUT_GAIN = 0.05  # an improvement is at least 5% more tasks/s
+DECREASE = 0.75
+
+
+class AdaptiveExecutor:
+    def __init__(self, min_workers=MIN_WORKERS, max_workers=MAX_WORKERS,
+                 interval=INTERVAL):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(
+                f"bad bounds: min_workers={min_workers}, "
+                f"max_workers={max_workers}"
+            )
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.limit = min_workers
+        self.slow_start = True
+        self.active = 0
+        self.condition = threading.Condition()
+        self.executor = futures.ThreadPoolExecutor(max_workers)
+        self.base_latency = None
+        self.last_throughput = 0
+        # (seconds since start, limit, tasks/s, mean latency) per interval
+        self.history = []
+        self.t0 = time.perf_counter()
+        self._new_window(self.t0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _new_window(self, now):
+        self.window_start = now
+        self.done = 0
+        self.failed = 0
+        self.total_latency = 0
+        self.waited = False
+
+    def _enter(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.waited = True
+                self.condition.wait()
+            self.active += 1
+
+    def _exit(self, latency, failed):
+        with self.condition:
+            self.active -= 1
+            self.done += 1
+            self.failed += failed
+            self.total_latency += latency
+            now = time.perf_counter()
+            if (now - self.window_start >= self.interval
+                    and self.done >= MIN_SAMPLES):
+                self._adapt(now)
+            self.condition.notify(max(1, self.limit - self.active))
+
+    def _adapt(self, now):
+        throughput = self.done / (now - self.window_start)
+        latency = self.total_latency / self.done
+        self.history.append((now - self.t0, self.limit, throughput, latency))
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        improved = (
+            throughput > self.last_throughput * (1 + THROUGHPUT_GAIN)
+        )
+        if self.failed or (
+            latency > self.base_latency * LATENCY_TOLERANCE
+            and not improved
+        ):
+            self.limit = max(self.min_workers, int(self.limit * DECREASE))
+            self.slow_start = False
+        elif (self.waited and throughput
+                >= self.last_throughput * (1 - THROUGHPUT_TOLERANCE)):
+            increase = self.limit if self.slow_start else 1
+            self.limit = min(self.max_workers, self.limit + increase)
+        self.last_throughput = throughput
+        self._new_window(now)
+
+    def _run(self, fn, *args):
+        self._enter()
+        t0 = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args)
+            failed = False
+            return result
+        finally:
+            self._exit(time.perf_counter() - t0, failed)
+
+    def submit(self, fn, *args):
+        return self.executor.submit(self._run, fn, *args)
+
+    def map(self, fn, iterable):
+        """As Executor.map(), the results in the order of the iterable"""
+        return self.executor.map(self._run, repeat(fn), iterable)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+    def report(self):
+        print("\n    time  workers   tasks/s  latency")
+        for elapsed, limit, throughput, latency in self.history:
+            print(f"{elapsed:>7.1f}s {limit:>8} {throughput:>9.1f} "
+                  f"{latency * 1000:>6.0f}ms")
+        print(f"final limit: {self.limit} workers "
+              f"[{self.min_workers}, {self.max_workers}]")
+
+
+def download_many(cc_list):
+    """thread_download_many_v1, with an adaptive number of workers"""
+    with AdaptiveExecutor() as executor:
+        res = executor.map(threads.download_one, sorted(cc_list))
+        count = len(list(res))
+    executor.report()
+    return count
+
+
+def benchmark(n_flags=2000, latency=0.1, capacity=16):
+    """
+    download_many() next to thread_download_many_v1 with a fixed number of
+    workers, against flags_server.py handling 'capacity' requests at once
+    """
+    from flags_server import clear_dest_dir, local_flags
+
+    results = []
+    max_workers = threads.MAX_WORKERS
+    with local_flags(int(n_flags), float(latency),
+                     capacity=int(capacity)) as cc_list:
+        try:
+            for workers in (4, threads.MAX_WORKERS, 32, MAX_WORKERS, None):
+                name = f"{workers} workers" if workers else "adaptive"
+                t0 = time.time()
+                if workers:
+                    threads.MAX_WORKERS = workers
+                    count = threads.thread_download_many_v1(cc_list)
+                else:
+                    count = download_many(cc_list)
+                results.append((name, count, time.time() - t0))
+                clear_dest_dir()
+        finally:
+            threads.MAX_WORKERS = max_workers
+    print()
+    for name, count, elapsed in results:
+        print(f"{name:>10}: {count} flags downloaded in {elapsed:.2f}s "
+              f"({count / elapsed:,.0f} flags/s)")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["local"]:
+        benchmark(*sys.argv[2:])
+    else:
+        threads.main(download_many)
+
+
+"""
+***** BENCHMARK (1 vCPU, Python 3.11, 2000 local flags) *******
+100ms latency, server handling 16 requests at once:
+- 4 workers: 56.00s (36 flags/s)
+- 12 workers: 18.93s (106 flags/s)
+- 32 workers: 12.65s (158 flags/s)
+- 64 workers: 12.65s (158 flags/s)
+- adaptive: 13.91s (144 flags/s), limit between 13 and 32, around 20
+20ms latency, server handling 8 requests at once:
+- 4 workers: 16.48s (121 flags/s)
+- 12 workers: 6.07s (330 flags/s)
+- 32 workers: 5.78s (346 flags/s)
+- 64 workers: 6.61s (303 flags/s)
+- adaptive: 7.31s (273 flags/s), limit between 11 and 32, around 15
+
+Conclusion: adaptive doesn't beat the best fixed number, it loses the first
+seconds to slow start and backs off once requests queue without more
+throughput, but it gets close to it without knowing the server. On the
+fast host, the latency doubles with the workers (the client's single core
+is busy) while the throughput still grows, backing off on latency alone
+ended below 4 workers.
+"""
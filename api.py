@@ -1,11 +1,30 @@
+import hashlib
+import os
+
 import bobo
 
 """
 very stupidly simple api
 
 run from command line: bobo -f api.py
+the size limit of /data/stream comes from the API_MAX_DATA_SIZE environment
+variable, or from bobo's configuration:
+    bobo -f api.py -c configure max_data_size=1048576
 """
 
+MAX_DATA_SIZE = 1024 * 1024 * 1024  # bytes accepted by post_data_stream
+PREFIX_SIZE = 64  # bytes of the payload echoed back by post_data_stream
+CHUNK_SIZE = 64 * 1024
+settings = {
+    "max_data_size": int(os.environ.get("API_MAX_DATA_SIZE", MAX_DATA_SIZE)),
+}
+
+
+def configure(config):
+    """bobo_configure hook, gets the name=value arguments of bobo"""
+    if "max_data_size" in config:
+        settings["max_data_size"] = int(config["max_data_size"])
+
 
 @bobo.query("/")
 def hello():
@@ -17,3 +36,55 @@ def hello():
 def post_data(data):
     # curl -i -X POST -d "data=xxx" http://localhost:8080/data
     return f"{len(data)} - {data} - {type(data)}"
+
+
+class DataTooLarge(Exception):
+    pass
+
+
+class DataSummary:
+    """
+    'post_data' holds the whole payload (and a copy of it in the response),
+    this one works like a hashlib object instead: feed it the body chunk by
+    chunk with update() and it only keeps the length, the sha256 and the
+    first PREFIX_SIZE bytes, so the memory per request doesn't depend on the
+    payload size
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = settings["max_data_size"]
+        self.max_size = max_size
+        self.length = 0
+        self.prefix = b""
+        self.sha256 = hashlib.sha256()
+
+    def update(self, chunk):
+        self.length += len(chunk)
+        if self.length > self.max_size:
+            raise DataTooLarge(f"more than {self.max_size} bytes")
+        if len(self.prefix) < PREFIX_SIZE:
+            self.prefix += chunk[:PREFIX_SIZE - len(self.prefix)]
+        self.sha256.update(chunk)
+
+    def __str__(self):
+        return f"{self.length} - {self.prefix!r} - {self.sha256.hexdigest()}"
+
+
+# bobo.post() would parse the form, reading the whole body, so this one is
+# a plain resource which gets the request untouched
+@bobo.resource("/data/stream", method="POST")
+def post_data_stream(bobo_request):
+    # curl -i -X POST --data-binary @big.file http://localhost:8080/data/stream
+    max_size = settings["max_data_size"]
+    if (bobo_request.content_length or 0) > max_size:
+        raise bobo.BoboException(413, f"more than {max_size} bytes")
+    summary = DataSummary(max_size)
+    body = bobo_request.body_file  # limited to Content-Length by webob
+    try:
+        for chunk in iter(lambda: body.read(CHUNK_SIZE), b""):
+            summary.update(chunk)
+    except DataTooLarge as error:
+        # a chunked body, without a Content-Length to check first
+        raise bobo.BoboException(413, str(error))
+    return str(summary)
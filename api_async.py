@@ -0,0 +1,246 @@
+"""
+The same very stupidly simple api of api.py, but served by a small asyncio
+HTTP/1.1 server built on asyncio.start_server (the same machinery of
+tcp_server.py) instead of bobo's synchronous WSGI:
+    - keep-alive: the connection is reused until the client asks
+      'Connection: close' (or goes idle for KEEP_ALIVE_TIMEOUT seconds)
+    - pipelining: requests already sent by the client are read and answered
+      in order, one after the other, on the same connection
+    - streaming request bodies: the body is read in CHUNK_SIZE pieces
+      (Content-Length or chunked), the route decides what to keep, i.e.:
+      /data/stream only keeps a DataSummary of it
+
+run from command line: python api_async.py [address] [port]
+(the size limit of /data/stream is API_MAX_DATA_SIZE, as for api.py)
+    curl -i http://localhost:8081/
+    curl -i -X POST -d "data=xxx" http://localhost:8081/data
+"""
+
+import asyncio
+import sys
+from urllib.parse import parse_qs
+
+from api import DataSummary, DataTooLarge, hello, post_data, settings
+
+CRLF = b"\r\n"
+HEADERS_END = CRLF + CRLF
+CHUNK_SIZE = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 5  # seconds waiting for the next request
+CONTENT_TYPE = "text/html; charset=UTF-8"  # same as bobo's default
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+class BadRequest(Exception):
+    status = 400
+
+
+class PayloadTooLarge(BadRequest):
+    status = 413
+
+
+class Request:
+    def __init__(self, method, path, version, headers, reader):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers  # lower case names
+        self.reader = reader
+        self._body = None
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    @property
+    def content_length(self):
+        try:
+            return int(self.headers.get("content-length", 0))
+        except ValueError:
+            raise BadRequest("invalid Content-Length")
+
+    def body(self):
+        """
+        Async iterator over the body in chunks of up to CHUNK_SIZE bytes,
+        always the same one, so a 2nd 'async for' resumes where the 1st
+        stopped
+        """
+        if self._body is None:
+            self._body = self._read_body()
+        return self._body
+
+    async def _read_body(self):
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            async for chunk in self._chunked_body():
+                yield chunk
+            return
+        remaining = self.content_length
+        while remaining > 0:
+            chunk = await self.reader.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise BadRequest("body shorter than Content-Length")
+            remaining -= len(chunk)
+            yield chunk
+
+    async def _chunked_body(self):
+        while True:
+            size_line = await self.reader.readuntil(CRLF)
+            try:
+                size = int(size_line.split(b";")[0], 16)
+            except ValueError:
+                raise BadRequest("invalid chunk size")
+            if not size:
+                break
+            while size > 0:
+                chunk = await self.reader.read(min(size, CHUNK_SIZE))
+                if not chunk:
+                    raise BadRequest("truncated chunk")
+                size -= len(chunk)
+                yield chunk
+            await self.reader.readexactly(len(CRLF))
+        # trailers, if any, end with an empty line
+        while await self.reader.readuntil(CRLF) != CRLF:
+            pass
+
+
+async def read_request(reader):
+    """Returns the next Request, or None if the client is gone"""
+    try:
+        head = await asyncio.wait_for(
+            reader.readuntil(HEADERS_END), KEEP_ALIVE_TIMEOUT
+        )
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest("headers too large")
+    try:
+        lines = head[:-len(HEADERS_END)].decode("latin-1").split("\r\n")
+        request_line, *header_lines = lines
+        method, path, version = request_line.split(" ")
+        headers = {}
+        for line in header_lines:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    except ValueError:
+        raise BadRequest("malformed request head")
+    return Request(method, path, version, headers, reader)
+
+
+async def read_form(request):
+    body = bytearray()
+    async for chunk in request.body():
+        body += chunk
+    return parse_qs(body.decode("latin-1"))
+
+
+async def get_hello(request):
+    # http://localhost:8081/
+    return 200, hello()
+
+
+async def post_form_data(request):
+    # curl -i -X POST -d "data=xxx" http://localhost:8081/data
+    form = await read_form(request)
+    if "data" not in form:
+        return 403, "Missing parameter: data"
+    return 200, post_data(form["data"][-1])
+
+
+async def post_data_stream(request):
+    # curl -i -X POST --data-binary @big.file http://localhost:8081/data/stream
+    max_size = settings["max_data_size"]
+    summary = DataSummary(max_size)
+    try:
+        if request.content_length > max_size:
+            raise DataTooLarge(f"more than {max_size} bytes")
+        async for chunk in request.body():
+            summary.update(chunk)
+    except DataTooLarge as error:
+        # we won't read the rest of it, the connection can't be reused
+        raise PayloadTooLarge(str(error))
+    return 200, str(summary)
+
+
+ROUTES = {
+    "/": {"GET": get_hello, "HEAD": get_hello},
+    "/data": {"POST": post_form_data},
+    "/data/stream": {"POST": post_data_stream},
+}
+
+
+def response(status, text, keep_alive):
+    body = text.encode()
+    head = (
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        f"Content-Type: {CONTENT_TYPE}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode(), body
+
+
+async def route(request):
+    methods = ROUTES.get(request.path.split("?")[0])
+    if methods is None:
+        return 404, "Not Found"
+    if request.method not in methods:
+        return 405, "Method Not Allowed"
+    return await methods[request.method](request)
+
+
+async def handle_http(reader, writer):
+    keep_alive = True
+    while keep_alive:
+        request = None
+        try:
+            request = await read_request(reader)
+            if request is None:
+                break
+            keep_alive = request.keep_alive
+            status, text = await route(request)
+            # whatever the route didn't read must go before the next request
+            async for _ in request.body():
+                pass
+        except BadRequest as error:
+            keep_alive = False
+            status, text = error.status, str(error)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            keep_alive = False
+            status, text = 400, "malformed body"
+        head, body = response(status, text, keep_alive)
+        if request is not None and request.method == "HEAD":
+            body = b""
+        writer.writelines((head, body))
+        try:
+            await writer.drain()
+        except ConnectionError:  # the client is gone
+            break
+    writer.close()
+
+
+def main(address="127.0.0.1", port=8081):
+    async def serve():
+        server = await asyncio.start_server(handle_http, address, int(port))
+        host = server.sockets[0].getsockname()
+        print("Serving on http://{}:{}. Hit CTRL-C to stop.".format(*host))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:  # CTRL+C pressed
+        pass
+    print("Server shutting down.")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,72 @@
+"""
+Load generator comparing 'bobo -f api.py' with 'python api_async.py', both
+started locally, with the same httpx client: CONCURRENCY keep-alive
+connections sending half GET / and half POST /data requests, reporting
+requests/s and p50/p99 latency.
+
+run from command line: python api_loadtest.py [n_requests] [concurrency]
+"""
+
+import asyncio
+import subprocess
+import sys
+import time
+
+import httpx
+
+ADDRESS = "127.0.0.1"
+SERVERS = {
+    "bobo": (["bobo", "-f", "api.py", "-p", "8080"], 8080),
+    "asyncio": ([sys.executable, "api_async.py", ADDRESS, "8081"], 8081),
+}
+
+
+async def worker(client, base_url, n_requests, latencies):
+    for i in range(n_requests):
+        t0 = time.perf_counter()
+        if i % 2:
+            resp = await client.post(
+                base_url + "/data", data={"data": "x" * i}
+            )
+        else:
+            resp = await client.get(base_url + "/")
+        resp.raise_for_status()
+        latencies.append(time.perf_counter() - t0)
+
+
+async def load(base_url, n_requests, concurrency):
+    latencies = []
+    limits = httpx.Limits(max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, base_url, n_requests // concurrency, latencies)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99) - 1])
+
+
+def main(n_requests=5000, concurrency=50):
+    n_requests, concurrency = int(n_requests), int(concurrency)
+    for name, (command, port) in SERVERS.items():
+        server = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            time.sleep(1)  # waiting for the server to start listening
+            rps, p50, p99 = asyncio.run(load(
+                f"http://{ADDRESS}:{port}", n_requests, concurrency
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{name:>7}: {rps:,.0f} requests/s, p50 {p50 * 1000:.1f}ms, "
+              f"p99 {p99 * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,74 @@
+"""
+Peak RSS of the api servers (bobo and asyncio, see api_loadtest.py) while
+handling a single POST of growing size, measured with memory_profiler on a
+fresh server process for every request:
+    - /data: the whole form is parsed and echoed back, RSS grows with the
+      payload
+    - /data/stream: the body is only fed to a DataSummary, RSS stays flat
+
+run from command line: python api_memory.py [max_size_mib]
+"""
+
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+from memory_profiler import memory_usage
+
+from api_loadtest import ADDRESS, SERVERS
+
+CHUNK = b"x" * 1024 * 1024
+
+
+def payload(size_mib, prefix=b""):
+    yield prefix
+    for _ in range(size_mib):
+        yield CHUNK
+
+
+def peak_rss(command, port, path, size_mib):
+    server = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    peak = []
+    monitor = threading.Thread(target=lambda: peak.append(
+        memory_usage(server, interval=0.01, max_usage=True)
+    ))
+    monitor.start()
+    try:
+        time.sleep(1)  # waiting for the server to start listening
+        prefix = b"data=" if path == "/data" else b""
+        resp = httpx.post(
+            f"http://{ADDRESS}:{port}{path}",
+            content=payload(size_mib, prefix),
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                # bobo's server doesn't understand chunked bodies
+                "Content-Length": str(len(prefix) + size_mib * len(CHUNK)),
+            },
+            timeout=None,
+        )
+        resp.raise_for_status()
+    finally:
+        server.terminate()
+        monitor.join()
+        server.wait()
+    return peak[0]
+
+
+def main(max_size_mib=64):
+    sizes = [1]
+    while sizes[-1] * 4 <= int(max_size_mib):
+        sizes.append(sizes[-1] * 4)
+    print("server    route          " + "".join(f"{s:>8}MiB" for s in sizes))
+    for name, (command, port) in SERVERS.items():
+        for path in ("/data", "/data/stream"):
+            peaks = [peak_rss(command, port, path, size) for size in sizes]
+            print(f"{name:<9} {path:<14} "
+                  + "".join(f"{peak:>8.1f}MiB" for peak in peaks))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -1,13 +1,39 @@
+import asyncio
 import mysql.connector
 import psycopg2 as postgres
+import sys
+import threading
+import time
 from abc import ABC
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from enum import Enum
 
 """
 A Factory class, as the name suggests, it's simply an abstract class which
 holds the logic for fabricating objects
+
+Here the objects are database connections, handed out by a bounded pool per
+driver and DSN, so threads don't share (or serialize on) a single connection.
+AsyncFactory is the asyncio counterpart, for coroutines.
+
+run from command line to put a pool under contention, i.e.:
+    python designpatterns/factory.py "host=localhost dbname=mydb" 50 20 10
+with 'asyncio' as 5th argument, the 50 are tasks on AsyncFactory instead of
+threads
 """
 
+POOL_SIZE = 10
+MAX_IDLE = 300  # seconds an idle connection is kept open
+CHECK_AFTER = 30  # seconds idle after which a connection is pinged
+CHECKOUT_TIMEOUT = 30
+# ConnectionPool.stats, all of them in metrics(), even before a checkout
+STATS = (
+    "opened", "checkouts", "waits", "wait_time", "max_wait", "max_open",
+    "evicted", "broken", "discarded", "timeouts",
+)
+
 
 class DBDriver(Enum):
     # Database constants
@@ -16,43 +42,602 @@ class DBDriver(Enum):
     # more constants...
 
 
+class PoolTimeout(Exception):
+    """No connection was given back to the pool in time"""
+
+
+def ping_postgres(conn):
+    if conn.closed:
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    conn.rollback()
+    return True
+
+
+def ping_mysql(conn):
+    return conn.is_connected()
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of the connections made by 'connect': no more
+    than 'size' of them are open at once, a thread asking for one while they
+    are all checked out waits for one to be released, up to 'timeout' seconds.
+    Idle connections are closed after 'max_idle' seconds, the ones idle for
+    more than 'check_after' seconds are 'ping'ed before being handed out
+    again, and replaced if broken.
+    """
+
+    def __init__(self, connect, ping, size=POOL_SIZE, max_idle=MAX_IDLE,
+                 check_after=CHECK_AFTER, timeout=CHECKOUT_TIMEOUT):
+        self._connect = connect
+        self._ping = ping
+        self.size = size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        # (connection, released at), the most recently used last: they're
+        # reused from the end, so the unneeded ones age at the beginning
+        self._idle = deque()
+        self._in_use = set()  # ids of the checked out connections
+        self._n_open = 0  # idle + checked out + being opened
+        self._lock = threading.Condition()
+        self.stats = Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _evict(self, now):
+        """Pops the connections idle for too long, to be closed unlocked"""
+        stale = []
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            stale.append(self._idle.popleft()[0])
+        self._n_open -= len(stale)
+        self.stats["evicted"] += len(stale)
+        return stale
+
+    def _checkout(self, deadline):
+        """
+        Returns (connection, idle since), or (None, None) when a slot is
+        reserved for the caller to open a new connection
+        """
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                stale = self._evict(now)
+                if stale:
+                    break
+                if self._idle:
+                    return self._idle.pop()
+                if self._n_open < self.size:
+                    self._n_open += 1
+                    self.stats["max_open"] = max(
+                        self.stats["max_open"], self._n_open
+                    )
+                    return None, None
+                if now >= deadline:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"all the {self.size} connections stayed checked out"
+                    )
+                self.stats["waits"] += 1
+                self._lock.wait(deadline - now)
+        for conn in stale:
+            self._close(conn)
+        return self._checkout(deadline)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass  # it's dropped anyway
+
+    def _healthy(self, conn):
+        try:
+            return self._ping(conn)
+        except Exception:
+            return False
+
+    def _discard(self, conn, reason=None):
+        with self._lock:
+            self._n_open -= 1
+            if reason:
+                self.stats[reason] += 1
+            self._lock.notify()
+        if conn is not None:
+            self._close(conn)
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a connection, give it back with release()
+
+        Raises:
+            PoolTimeout -- all the connections stayed checked out
+        """
+        t0 = time.monotonic()
+        deadline = t0 + (self.timeout if timeout is None else timeout)
+        opened = False
+        while True:
+            conn, idle_since = self._checkout(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    self._discard(None)
+                    raise
+                opened = True
+                break
+            if (time.monotonic() - idle_since < self.check_after
+                    or self._healthy(conn)):
+                break
+            self._discard(conn, "broken")
+        waited = time.monotonic() - t0
+        with self._lock:
+            self._in_use.add(id(conn))
+            self.stats["checkouts"] += 1
+            self.stats["opened"] += opened
+            self.stats["wait_time"] += waited
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        return conn
+
+    def owns(self, conn):
+        return id(conn) in self._in_use
+
+    def release(self, conn, discard=False):
+        """
+        Gives a connection back, what wasn't committed is rolled back,
+        discard: close it instead (i.e.: it's known to be broken)
+        """
+        if not discard:
+            try:
+                conn.rollback()  # no transaction left open between checkouts
+            except Exception:
+                discard = True
+        with self._lock:
+            self._in_use.remove(id(conn))
+            if not discard:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+                return
+        self._discard(conn, "discarded")
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """with pool.connection() as conn: ..., released when leaving"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self):
+        metrics = dict.fromkeys(STATS, 0)
+        with self._lock:
+            metrics.update(
+                self.stats, size=self.size, open=self._n_open,
+                idle=len(self._idle), in_use=len(self._in_use),
+            )
+        checkouts = metrics["checkouts"]
+        metrics["mean_wait"] = (
+            metrics["wait_time"] / checkouts if checkouts else 0
+        )
+        return metrics
+
+    def close(self):
+        """
+        Closes the idle connections, the ones checked out are closed by the
+        1st checkout following their release
+        """
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._n_open -= len(idle)
+            # no idle connection is kept anymore
+            self.max_idle = -1
+        for conn in idle:
+            self._close(conn)
+
+
 class Factory(ABC):
-    # Final Class - Factory to return connect object
-    __postgresConn = None
-    __mysqlConn = None
-    # more connections vars...
+    # Final Class - Factory to return connect object, from a pool of them for
+    # each driver and DSN
+    DSN = {
+        DBDriver.POSTGRES: "host=localhost port=5432 dbname=mydb user=myuser",
+        DBDriver.MYSQL: dict(
+            user='myuser',
+            password='password',
+            host='localhost',
+            database='mydb'
+        ),
+        # more default DSNs...
+    }
+    __pools = {}
+    __pools_lock = threading.Lock()
+
+    @staticmethod
+    def _opener(dao, dsn):
+        """Returns (connect, ping) functions for the driver"""
+        if dao == DBDriver.POSTGRES:
+            return lambda: postgres.connect(dsn), ping_postgres
+        elif dao == DBDriver.MYSQL:
+            return lambda: mysql.connector.connect(**dsn), ping_mysql
+        else: raise NotImplementedError("DB Driver not implemented")
 
     @classmethod
-    def connect(cls, dao):
+    def pool(cls, dao, dsn=None, **options):
         """
-        Returns a connection
-        
+        Returns the pool of connections for a driver and DSN
+
         Arguments:
             dao {Enum} -- Database driver constant
-        
+            dsn {str or dict} -- connection string or arguments, defaults to
+                Factory.DSN[dao]
+            options -- ConnectionPool arguments, used on the 1st call only
+
         Returns:
-            any -- connection with a datasource
+            ConnectionPool -- created on first use
         """
-        if dao == DBDriver.POSTGRES:
-            if not cls.__postgresConn:
-                print('pg')
-                cls.__postgresConn = postgres.connect(
-                    "host=localhost port=5432 dbname=mydb user=myuser"
+        if dsn is None:
+            dsn = cls.DSN.get(dao)
+        key = (dao, dsn if isinstance(dsn, str) else
+               tuple(sorted(dsn.items())) if dsn else None)
+        with cls.__pools_lock:
+            pool = cls.__pools.get(key)
+            if pool is None:
+                connect, ping = cls._opener(dao, dsn)
+                pool = cls.__pools[key] = ConnectionPool(
+                    connect, ping, **options
                 )
-            return cls.__postgresConn
-        elif dao == DBDriver.MYSQL:
-            if not cls.__mysqlConn:
-                print('mysql')
-                cls.__mysqlConn = mysql.connector.connect(
-                    user='myuser',
-                    password='password',
-                    host='localhost',
-                    database='mydb'
-                )
-            return cls.__mysqlConn
-        else: raise NotImplementedError("DB Driver not implemented")
+            return pool
+
+    @classmethod
+    def connect(cls, dao, dsn=None, timeout=None):
+        """
+        Returns a connection
+
+        Arguments:
+            dao {Enum} -- Database driver constant
+
+        Returns:
+            any -- connection with a datasource, checked out of its pool,
+                to be given back with Factory.release()
+        """
+        return cls.pool(dao, dsn).acquire(timeout)
+
+    @classmethod
+    def release(cls, conn, discard=False):
+        with cls.__pools_lock:
+            pools = list(cls.__pools.values())
+        for pool in pools:
+            if pool.owns(conn):
+                return pool.release(conn, discard)
+        raise ValueError("connection not checked out of a Factory pool")
+
+    @classmethod
+    def connection(cls, dao, dsn=None, timeout=None):
+        """with Factory.connection(DBDriver.POSTGRES) as conn: ..."""
+        return cls.pool(dao, dsn).connection(timeout)
+
+    @classmethod
+    def close(cls):
+        with cls.__pools_lock:
+            pools = list(cls.__pools.values())
+            cls.__pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+class AsyncConnection:
+    """
+    Async face of a blocking connection, every call runs in the thread pool
+    of the AsyncPool it comes from:
+        rows = await conn.fetchall("SELECT ...", params)
+    """
+
+    def __init__(self, conn, pool):
+        self.conn = conn  # the blocking connection itself
+        self.pool = pool
+
+    async def run(self, function, *args):
+        """await function(blocking connection, *args), in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool.executor, function, self.conn, *args
+        )
+
+    @staticmethod
+    def _execute(conn, query, params, fetch):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    async def execute(self, query, params=None):
+        """Returns the number of rows affected"""
+        return await self.run(self._execute, query, params, None)
+
+    async def fetchone(self, query, params=None):
+        return await self.run(self._execute, query, params, "one")
+
+    async def fetchall(self, query, params=None):
+        return await self.run(self._execute, query, params, "all")
+
+    async def commit(self):
+        await self.run(lambda conn: conn.commit())
+
+    async def rollback(self):
+        await self.run(lambda conn: conn.rollback())
+
+
+class AsyncPool:
+    """
+    asyncio side of a ConnectionPool: none of the drivers of Factory has a
+    native async API, so the blocking calls (checkouts, queries, releases)
+    run in a thread pool of their own, with a thread for each connection of
+    the pool. Coroutines waiting for a connection wait on the loop, on an
+    asyncio.Semaphore, not on a thread.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(
+            pool.size, thread_name_prefix="db-connection"
+        )
+        self._slots = None
+        self._loop = None
+        # waits as seen by the coroutines, async_* in metrics()
+        self.stats = Counter()
+
+    def _semaphore(self):
+        # a semaphore only works in the loop it was first used in
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.pool.size)
+        return self._slots
+
+    async def acquire(self, timeout=None):
+        """
+        Checks out an AsyncConnection, give it back with release()
+
+        Raises:
+            PoolTimeout -- all the connections stayed checked out
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._semaphore()
+        timeout = self.pool.timeout if timeout is None else timeout
+        t0 = loop.time()
+        deadline = t0 + timeout
+        if not slots.locked():
+            await slots.acquire()  # a free slot, returns without suspending
+        else:
+            self.stats["waits"] += 1
+            try:
+                await asyncio.wait_for(slots.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise PoolTimeout(
+                    f"all the {self.pool.size} connections stayed checked out"
+                ) from None
+        checkout = loop.run_in_executor(
+            self.executor, self.pool.acquire, max(deadline - loop.time(), 0)
+        )
+        try:
+            # shielded: the checkout goes on in its thread anyway
+            conn = await asyncio.shield(checkout)
+        except asyncio.CancelledError:
+            checkout.add_done_callback(self._release_orphan)
+            raise
+        except BaseException:
+            slots.release()
+            raise
+        waited = loop.time() - t0
+        self.stats["checkouts"] += 1
+        self.stats["wait_time"] += waited
+        self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        return AsyncConnection(conn, self)
+
+    def _release_orphan(self, checkout):
+        """A checkout finishing after its coroutine was cancelled"""
+        if not checkout.cancelled() and checkout.exception() is None:
+            self.executor.submit(self.pool.release, checkout.result())
+        self._slots.release()
+
+    async def release(self, conn, discard=False):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self.executor, self.pool.release, conn.conn, discard
+            )
+        finally:
+            self._semaphore().release()
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        """async with pool.connection() as conn: ..., released when leaving"""
+        conn = await self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    def metrics(self):
+        """
+        The metrics of the pool (the waits of its threads), with the waits of
+        the coroutines as async_waits, async_mean_wait, async_max_wait and
+        async_timeouts
+        """
+        metrics = self.pool.metrics()
+        checkouts = self.stats["checkouts"]
+        metrics.update(
+            async_waits=self.stats["waits"],
+            async_mean_wait=(
+                self.stats["wait_time"] / checkouts if checkouts else 0
+            ),
+            async_max_wait=self.stats["max_wait"],
+            async_timeouts=self.stats["timeouts"],
+        )
+        return metrics
+
+    def close(self):
+        self.pool.close()
+        self.executor.shutdown(wait=False)
+
+
+class AsyncFactory(ABC):
+    # Final Class - asyncio counterpart of Factory, returning async
+    # connections out of the same pools
+    __pools = {}
+    __pools_lock = threading.Lock()
+
+    @classmethod
+    def pool(cls, dao, dsn=None, **options):
+        """
+        Returns the AsyncPool wrapping Factory.pool(dao, dsn, **options)
+        """
+        pool = Factory.pool(dao, dsn, **options)
+        with cls.__pools_lock:
+            async_pool = cls.__pools.get(pool)
+            if async_pool is None:
+                async_pool = cls.__pools[pool] = AsyncPool(pool)
+            return async_pool
+
+    @classmethod
+    async def connect(cls, dao, dsn=None, timeout=None):
+        """
+        Returns an async connection
+
+        Arguments:
+            dao {Enum} -- Database driver constant
+
+        Returns:
+            AsyncConnection -- checked out of its pool, to be given back
+                with AsyncFactory.release()
+        """
+        return await cls.pool(dao, dsn).acquire(timeout)
+
+    @classmethod
+    async def release(cls, conn, discard=False):
+        await conn.pool.release(conn, discard)
+
+    @classmethod
+    def connection(cls, dao, dsn=None, timeout=None):
+        """async with AsyncFactory.connection(DBDriver.POSTGRES) as conn:"""
+        return cls.pool(dao, dsn).connection(timeout)
+
+    @classmethod
+    def close(cls):
+        with cls.__pools_lock:
+            pools = list(cls.__pools.values())
+            cls.__pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+def print_metrics(metrics):
+    print(f"{metrics['opened']} connections opened (max open "
+          f"{metrics['max_open']}/{metrics['size']}), "
+          f"{metrics['checkouts']} checkouts, {metrics['waits']} waits, "
+          f"mean wait {metrics['mean_wait'] * 1000:.2f}ms, max wait "
+          f"{metrics['max_wait'] * 1000:.2f}ms")
+    if "async_waits" in metrics:
+        print(f"coroutines: {metrics['async_waits']} waits, mean wait "
+              f"{metrics['async_mean_wait'] * 1000:.2f}ms, max wait "
+              f"{metrics['async_max_wait'] * 1000:.2f}ms")
+
+
+async def async_main(dsn, n_tasks, n_queries, size):
+    """
+    The same load from asyncio tasks, with a ticker measuring how late the
+    loop runs it, the loop is free while the queries run
+    """
+    pool = AsyncFactory.pool(DBDriver.POSTGRES, dsn, size=size)
+    errors = Counter()
+    max_lag = 0
+
+    async def run():
+        for _ in range(n_queries):
+            try:
+                async with pool.connection() as conn:
+                    await conn.execute("SELECT pg_sleep(0.001)")
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+
+    async def ticker(interval=0.005):
+        nonlocal max_lag
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(interval)
+            max_lag = max(max_lag, loop.time() - t0 - interval)
+
+    ticking = asyncio.create_task(ticker())
+    t0 = time.time()
+    await asyncio.gather(*(run() for _ in range(n_tasks)))
+    elapsed = time.time() - t0
+    ticking.cancel()
+    print(f"{n_tasks * n_queries} queries from {n_tasks} tasks in "
+          f"{elapsed:.2f}s, errors: {dict(errors)}, max loop lag "
+          f"{max_lag * 1000:.2f}ms")
+    print_metrics(pool.metrics())
+    AsyncFactory.close()
+
+
+def main(dsn=None, n_threads=50, n_queries=20, size=POOL_SIZE,
+         mode="threads"):
+    """
+    n_threads threads (or asyncio tasks) running n_queries queries each,
+    through a pool of 'size' PostgreSQL connections
+    """
+    n_threads, n_queries = int(n_threads), int(n_queries)
+    if mode == "asyncio":
+        asyncio.run(async_main(dsn, n_threads, n_queries, int(size)))
+        Factory.close()
+        return
+    pool = Factory.pool(DBDriver.POSTGRES, dsn, size=int(size))
+    errors = Counter()
+
+    def run():
+        for _ in range(n_queries):
+            try:
+                with pool.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(0.001)")
+            except Exception as exc:
+                errors[type(exc).__name__] += 1
+
+    threads = [threading.Thread(target=run) for _ in range(n_threads)]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - t0
+    print(f"{n_threads * n_queries} queries from {n_threads} threads in "
+          f"{elapsed:.2f}s, errors: {dict(errors)}")
+    print_metrics(pool.metrics())
+    Factory.close()
 
 
-# Usage:
-pg_conn = Factory.connect(DBDriver.POSTGRES)
-mysql_conn = Factory.connect(DBDriver.MYSQL)
\ No newline at end of file
+if __name__ == "__main__":
+    # Usage:
+    #   pg_conn = Factory.connect(DBDriver.POSTGRES)
+    #   ...
+    #   Factory.release(pg_conn)
+    # or
+    #   with Factory.connection(DBDriver.MYSQL) as mysql_conn:
+    #       ...
+    # or, in a coroutine
+    #   async with AsyncFactory.connection(DBDriver.POSTGRES) as pg_conn:
+    #       rows = await pg_conn.fetchall("SELECT ...")
+    main(*sys.argv[1:])
@@ -0,0 +1,252 @@
+"""
+Download engine for the flags of threads.py, for long lists of them and not
+so reliable servers: get_flag() has no timeout nor retry, one failure ends
+the whole thread_download_many_v1/v2 run, and the next run starts all over.
+
+Here:
+- every thread keeps a requests.Session of its own, so its connection is
+  reused from one flag to the next (Sessions aren't thread-safe)
+- failed requests (connection errors, timeouts, 429 and 5xx, bodies cut
+  short) are retried, with an exponential backoff and full jitter, up to
+  RETRIES times
+- a token bucket shared by all the threads caps the rate of requests
+- a flag already in DEST_DIR with the size (Content-Length) and the ETag of
+  the server's one is skipped, an interrupted run is resumed by running it
+  again
+- flags are streamed to a temporary file, renamed once complete, so an
+  interrupted download leaves no partial flag (threads.save_flag_stream())
+- a flag which still fails is counted, the others go on
+
+run from command line: python download_engine.py [local [n_flags] [latency]
+[error_rate]] (against flags_server.py, twice: the 2nd run skips them all)
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent import futures
+
+import requests
+
+import threads
+
+RETRIES = 5
+BACKOFF = 0.5  # seconds before the 1st retry, doubled for every next one
+MAX_BACKOFF = 30
+RATE = 100  # requests/s, None for no limit
+BURST = 20  # requests allowed at once after some idle time
+TIMEOUT = (3.05, 30)  # seconds to connect, to read
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,  # body cut short
+)
+
+
+class DownloadError(Exception):
+    """A request still failing after all the retries"""
+
+
+class TokenBucket:
+    """'rate' tokens/s, up to 'burst' of them saved, thread-safe"""
+
+    def __init__(self, rate, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, waiting for one if there's none"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def read_etag(path):
+    try:
+        with open(path + ".etag") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_etag(path, etag):
+    """Next to the file, as <file>.etag"""
+    if etag is None:
+        if os.path.exists(path + ".etag"):
+            os.remove(path + ".etag")
+        return
+    with open(path + ".etag", "w") as f:
+        f.write(etag)
+
+
+class DownloadEngine:
+    def __init__(self, workers=threads.MAX_WORKERS, retries=RETRIES,
+                 backoff=BACKOFF, rate=RATE, timeout=TIMEOUT):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate) if rate else None
+        self.stats = Counter()
+        self.errors = []
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def session(self):
+        """The Session of the current thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def request(self, method, url, read=None):
+        """
+        Sends the request, rate limited, retrying what can be retried.
+        With 'read', the body is streamed to read(resp) inside the retries
+        (a connection lost in the middle of it is retried too) and what it
+        returns is returned instead of the response
+
+        Raises:
+            DownloadError -- still failing after the retries
+            requests.HTTPError -- the other 4xx statuses (not retried)
+        """
+        for attempt in range(self.retries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            retry_after = None
+            try:
+                resp = self.session().request(
+                    method, url, timeout=self.timeout,
+                    stream=read is not None,
+                )
+                with resp:  # back to the pool, even when streaming
+                    if resp.status_code not in RETRY_STATUSES:
+                        resp.raise_for_status()
+                        return read(resp) if read else resp
+                    error = f"HTTP {resp.status_code}"
+                    retry_after = resp.headers.get("Retry-After")
+            except RETRY_ERRORS as exc:
+                error = exc
+            if attempt == self.retries:
+                raise DownloadError(f"{method} {url}: {error}")
+            self.count("retries")
+            delay = random.uniform(
+                0, min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+            )
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def is_current(self, url, path):
+        """The file is there, with the size and ETag of the server's one"""
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return False
+        resp = self.request("HEAD", url)
+        length = resp.headers.get("Content-Length")
+        if length is None or int(length) != size:
+            return False
+        etag = resp.headers.get("ETag")
+        return etag is None or etag == read_etag(path)
+
+    def download_to(self, url, filename):
+        """
+        GETs the url into DEST_DIR/filename, streamed, retrying the whole
+        download, returns (size, ETag)
+        """
+        def save(resp):
+            size = threads.save_flag_stream(
+                resp.iter_content(threads.CHUNK_SIZE), filename
+            )
+            return size, resp.headers.get("ETag")
+
+        return self.request("GET", url, read=save)
+
+    def download_one(self, cc):
+        """threads.download_one(), skipping the flags already downloaded"""
+        filename = cc.lower() + ".gif"
+        url = "{}/{cc}/{cc}.gif".format(threads.BASE_URL, cc=cc.lower())
+        path = os.path.join(threads.DEST_DIR, filename)
+        if self.is_current(url, path):
+            self.count("skipped")
+            return cc
+        size, etag = self.download_to(url, filename)
+        write_etag(path, etag)
+        self.count("downloaded")
+        self.count("bytes", size)
+        threads.show(cc)
+        return cc
+
+    def download_many(self, cc_list):
+        """Returns the number of flags in DEST_DIR, downloaded or not"""
+        t0 = time.time()
+        with futures.ThreadPoolExecutor(self.workers) as executor:
+            to_do = {
+                executor.submit(self.download_one, cc): cc
+                for cc in sorted(cc_list)
+            }
+            for future in futures.as_completed(to_do):
+                try:
+                    future.result()
+                except (DownloadError, requests.RequestException) as exc:
+                    self.count("failed")
+                    self.errors.append((to_do[future], exc))
+        for session in self._sessions:
+            session.close()
+        self._sessions.clear()
+        self.report(time.time() - t0)
+        return self.stats["downloaded"] + self.stats["skipped"]
+
+    def report(self, elapsed):
+        stats = self.stats
+        n_flags = stats["downloaded"] + stats["skipped"] + stats["failed"]
+        print(f"\n{stats['downloaded']} downloaded, {stats['skipped']} "
+              f"skipped, {stats['failed']} failed, {stats['retries']} "
+              f"retries in {elapsed:.2f}s ({n_flags / elapsed:.1f} flags/s, "
+              f"{stats['bytes'] / elapsed / 2**20:.2f}MiB/s)")
+        for cc, exc in self.errors:
+            print(f"{cc}: {exc}")
+
+
+def download_many(cc_list):
+    return DownloadEngine().download_many(cc_list)
+
+
+def local_runs(n_flags=500, latency=0.05, error_rate=0.05):
+    from flags_server import local_flags
+
+    with local_flags(int(n_flags), float(latency),
+                     error_rate=float(error_rate)) as cc_list:
+        for _ in range(2):
+            download_many(cc_list)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["local"]:
+        local_runs(*sys.argv[2:])
+    else:
+        threads.main(download_many)
@@ -0,0 +1,167 @@
+"""
+Local stand-in for the flags site of threads.py (BASE_URL), to benchmark the
+downloaders without depending on the Internet: any /<cc>/<cc>.gif path is a
+flag of FLAG_SIZE bytes, sent after LATENCY seconds (the injected network
+latency), with its Content-Length and an ETag, over keep-alive connections.
+A share of the requests (ERROR_RATE) can fail with a 503, and as many GETs
+lose their connection in the middle of the body, to see retries,
+and the server can handle only CAPACITY of them at once, the others wait
+for their turn (more clients then only add latency, not throughput).
+
+    with local_flags(2000, latency=0.05) as cc_list:
+        main(download_many)  # threads.BASE_URL and DEST_DIR point here
+
+run from command line: python flags_server.py [port] [latency] [size]
+[error_rate] [capacity]
+"""
+
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain, islice, product
+from string import ascii_uppercase
+
+import threads
+
+ADDRESS = "127.0.0.1"
+PORT = 8001
+LATENCY = 0.05
+ERROR_RATE = 0
+CAPACITY = 0  # requests handled at once, 0 for no limit
+FLAG_SIZE = 2 * 1024  # about the size of the real flags
+CHUNK_SIZE = 64 * 1024
+CHUNK = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+
+def country_codes(n_codes):
+    """'n_codes' fake country codes: AA, AB... ZZ, AAA, AAB..."""
+    codes = chain(
+        product(ascii_uppercase, repeat=2), product(ascii_uppercase, repeat=3)
+    )
+    return ["".join(code) for code in islice(codes, n_codes)]
+
+
+class FlagHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    latency = LATENCY
+    size = FLAG_SIZE
+    error_rate = ERROR_RATE
+    slots = None  # a semaphore of CAPACITY slots when limited
+
+    def flag(self):
+        """The country code of the path, None (and a 404) if it's not one"""
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2 and parts[1] == parts[0] + ".gif":
+            return parts[0]
+        self.send_error(404)
+        return None
+
+    def send_flag_headers(self, cc):
+        """Returns False if it sent an (injected) error instead"""
+        if self.slots:
+            with self.slots:
+                time.sleep(self.latency)
+        else:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.send_error(503)
+            return False
+        self.send_response(200)
+        self.send_header("Content-Type", "image/gif")
+        self.send_header("Content-Length", str(self.size))
+        self.send_header("ETag", f'"{cc}-{self.size}"')
+        self.end_headers()
+        return True
+
+    def do_HEAD(self):
+        cc = self.flag()
+        if cc:
+            self.send_flag_headers(cc)
+
+    def do_GET(self):
+        cc = self.flag()
+        if not (cc and self.send_flag_headers(cc)):
+            return
+        remaining = self.size
+        if random.random() < self.error_rate:  # cut in the middle
+            remaining //= 2
+            self.close_connection = True
+        while remaining:
+            chunk = CHUNK[:min(remaining, CHUNK_SIZE)]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass  # thousands of requests
+
+
+class FlagServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the clients connect by thousands
+
+
+def serve(port=PORT, latency=LATENCY, size=FLAG_SIZE, error_rate=ERROR_RATE,
+          capacity=CAPACITY):
+    FlagHandler.latency = float(latency)
+    FlagHandler.size = int(size)
+    FlagHandler.error_rate = float(error_rate)
+    if int(capacity):
+        FlagHandler.slots = threading.Semaphore(int(capacity))
+    with FlagServer((ADDRESS, int(port)), FlagHandler) as server:
+        server.serve_forever()
+
+
+def wait_listening(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((ADDRESS, port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@contextmanager
+def local_flags(n_flags, latency=LATENCY, size=FLAG_SIZE, port=PORT,
+                error_rate=ERROR_RATE, capacity=CAPACITY):
+    """
+    Starts the server in another process (not to compete with the client
+    for the GIL), points threads.BASE_URL to it and threads.DEST_DIR to a
+    temporary directory, yields 'n_flags' country codes
+    """
+    server = subprocess.Popen(
+        [sys.executable, __file__, str(port), str(latency), str(size),
+         str(error_rate), str(capacity)]
+    )
+    dest_dir = tempfile.mkdtemp(prefix="flags_")
+    base_url, threads_dest_dir = threads.BASE_URL, threads.DEST_DIR
+    threads.BASE_URL = f"http://{ADDRESS}:{port}"
+    threads.DEST_DIR = dest_dir
+    try:
+        wait_listening(port)
+        yield country_codes(n_flags)
+    finally:
+        threads.BASE_URL, threads.DEST_DIR = base_url, threads_dest_dir
+        server.terminate()
+        server.wait()
+        shutil.rmtree(dest_dir)
+
+
+def clear_dest_dir():
+    """Removes the flags downloaded in threads.DEST_DIR"""
+    for name in os.listdir(threads.DEST_DIR):
+        os.remove(os.path.join(threads.DEST_DIR, name))
+
+
+if __name__ == "__main__":
+    serve(*sys.argv[1:])
@@ -4,7 +4,11 @@ from time import sleep
 from multiprocessing import Process, Pipe
 from random import random
 
+from ring_buffer import RingBuffer
 
+
+# a Process per job pays the start of a process every time, for many small
+# jobs see the pre-forked workers of process_pool.py
 def task():
     sleep(60)
 
@@ -71,3 +75,45 @@ if __name__ == '__main__':
     # wait for all processes to finish
     sender_process.join()
     receiver_process.join()
+
+
+"""
+The same with a RingBuffer (see ring_buffer.py): the values are copied by
+batches into shared memory, instead of being pickled and sent one by one,
+python ring_buffer.py compares them
+"""
+
+
+def sender_ring(ring):
+    print('Sender: Running', flush=True)
+    values = [random() for i in range(10)]
+    # send data
+    print(f"sending {values}", flush=True)
+    ring.put_many(values)
+    ring.finish()
+    print('Sender: Done', flush=True)
+
+
+# consume work
+def receiver_ring(ring):
+    print('Receiver: Running', flush=True)
+    while values := ring.get_many():
+        print(f'>receiver got {values.tolist()}', flush=True)
+    print('Receiver: Done', flush=True)
+
+
+# entry point
+if __name__ == '__main__':
+    # create the ring buffer
+    ring = RingBuffer()
+    # start the sender
+    sender_process = Process(target=sender_ring, args=(ring,))
+    sender_process.start()
+    # start the receiver
+    receiver_process = Process(target=receiver_ring, args=(ring,))
+    receiver_process.start()
+    # wait for all processes to finish
+    sender_process.join()
+    receiver_process.join()
+    ring.close()
+    ring.unlink()
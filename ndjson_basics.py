@@ -1,13 +1,21 @@
 import json
+import threading
 import time
 from sys import getsizeof
 
 import ndjson
 import psycopg2
 import requests
-from flask import Flask, stream_with_context
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS, cross_origin
 
+from designpatterns.factory import DBDriver, Factory
+from ndjson_db import (
+    USERS_COLUMNS, bulk_load, ndjson_rows, random_users, stream_query
+)
+from ndjson_index import LineIndex
+from ndjson_stream import gzip_chunks, iter_chunks
+
 """
 The main difference of JSON and NDJSON (New Line Delimited JSON) is the
 geometry of the data:
@@ -46,6 +54,9 @@ with open(ndjson_file) as f:
         # print(f'\nndjson streamed {getsizeof(line)}bytes in {elapsed:.2f}s')
     elapsed = time.time() - t0
     print(f"processed {names.__len__()} objects in {elapsed:.2f}s")
+# for files too big for a single core, ndjson_parallel.py splits this same
+# loop across processes, and ndjson_mmap.py only decodes the lines which
+# actually have a "name"
 
 # and we could also have a streamed JSON response
 t0 = time.time()
@@ -62,11 +73,45 @@ print(f"\nndjson response {getsizeof(ndjson_data)}bytes in {elapsed:.2f}s")
 
 # we can also stream our data via API
 app = Flask(__name__)
+# production mode streams the raw file in big chunks instead of slowly
+# dumping record by record, set it with: export FLASK_NDJSON_PRODUCTION=true
+app.config["NDJSON_PRODUCTION"] = False
+app.config["NDJSON_CHUNK_SIZE"] = 64 * 1024
+app.config.from_prefixed_env()
+
+MAX_PAGE_LINES = 10_000
+ndjson_file_index = None  # built on the 1st paged request, see ndjson_index
+ndjson_file_index_lock = threading.Lock()  # not twice by concurrent requests
 
 
 @app.route("/stream-ndjson-file")
 @cross_origin()
 def stream_ndjson_file():
+    # a page of the file, i.e.: ?offset=5000000&limit=1000, costs 1 seek
+    # thanks to the line offsets index
+    if "offset" in request.args or "limit" in request.args:
+        global ndjson_file_index
+        with ndjson_file_index_lock:
+            if ndjson_file_index is None:
+                ndjson_file_index = LineIndex(ndjson_file)
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit = request.args.get("limit", MAX_PAGE_LINES, type=int)
+        page = ndjson_file_index.read_lines(
+            offset, min(limit, MAX_PAGE_LINES)
+        )
+        return Response(page, mimetype="application/x-ndjson")
+
+    if app.config["NDJSON_PRODUCTION"]:
+        # no decoding/encoding, no tiny chunks, and gzip if the client can
+        chunks = iter_chunks(ndjson_file, app.config["NDJSON_CHUNK_SIZE"])
+        headers = {"Vary": "Accept-Encoding"}
+        if request.accept_encodings["gzip"]:
+            chunks = gzip_chunks(chunks)
+            headers["Content-Encoding"] = "gzip"
+        return Response(
+            chunks, mimetype="application/x-ndjson", headers=headers
+        )
+
     @stream_with_context
     def ndjson_line_generator():
         with open(ndjson_file) as f:
@@ -74,7 +119,7 @@ def stream_ndjson_file():
             for line in reader:
                 time.sleep(1)  # just to see the streaming slowly
                 # (remove it in a real app of course)
-                yield json.dumps(line)
+                yield json.dumps(line) + "\n"  # the new line IS the NDJSON
 
     return ndjson_line_generator()
 
@@ -83,11 +128,14 @@ def stream_ndjson_file():
 #   flask --app ndjson_basics run
 # then you can access the streamed data it in the URL:
 #   localhost:5000/stream-ndjson-file
+# or just a page of it:
+#   localhost:5000/stream-ndjson-file?offset=5000000&limit=1000
 
 
-conn = psycopg2.connect(
+DB_DSN = (
     "host=localhost port=5002 dbname=xchango user=postgres password=25012023"
 )
+conn = psycopg2.connect(DB_DSN)
 
 
 def create_table():
@@ -106,19 +154,15 @@ def create_table():
 
 def generate_random_data():
     conn.autocommit = False
-    import hashlib
+    # 1 single COPY streaming the rows instead of 1 INSERT per row, see
+    # ndjson_db_benchmark.py for how much faster it is
+    bulk_load(conn, "users", USERS_COLUMNS, random_users(10_000))
+    print("data inserted")
 
-    with conn.cursor() as c:
-        for i in range(10_000):
-            md5 = hashlib.md5(f"{i}".encode()).hexdigest()
-            c.execute(
-                "INSERT INTO users (uuid, first_name, last_name, email, "
-                "password) "
-                f"VALUES('{md5}', 'f{i}', 'l{1}', 'e{1}@test.com', 'pass{i}')"
-            )
-            print('.', end='', flush=True)
-        print("data inserted")
-    conn.commit()
+
+def load_ndjson_data(path):
+    # same, but the users come from an NDJSON file
+    bulk_load(conn, "users", USERS_COLUMNS, ndjson_rows(path))
 
 # create_table()  # comment this after running 1st time to avoid the overload
 # generate_random_data()  # comment this after running 1st time to avoid the
@@ -126,12 +170,28 @@ def generate_random_data():
 @app.route("/stream-ndjson-db")
 @cross_origin()
 def stream_ndjson_db():
+    if app.config["NDJSON_PRODUCTION"]:
+        # a real server-side cursor, fetching adaptive batches, each batch
+        # becomes one NDJSON chunk (see ndjson_db), on a connection of the
+        # stream's own, given back to the pool when it ends (or the client
+        # goes away), concurrent streams can't share the global 'conn'
+        def users_stream():
+            with Factory.connection(DBDriver.POSTGRES, DB_DSN) as stream_conn:
+                yield from stream_query(stream_conn, 'SELECT * FROM "users"')
+
+        return Response(
+            stream_with_context(users_stream()),
+            mimetype="application/x-ndjson",
+        )
+
     @stream_with_context
     def ndjson_record_generator():
         with conn.cursor() as cursor:
             """
             itersize: should be a value to balance the network calls X memory.
             i.e.: if we have 100 rows, itersize=2 results in 50 network calls.
+            BUT it's only used by named (server-side) cursors, this one
+            brings the whole result to the client in execute() anyway.
             """
             cursor.itersize = 1
             cursor.execute('SELECT * FROM "users" LIMIT 10000')
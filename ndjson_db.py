@@ -0,0 +1,198 @@
+"""
+Database side of ndjson_basics.py, streaming query results as NDJSON.
+
+A plain psycopg2 cursor ignores 'itersize': execute() pulls the whole result
+to the client at once, only a named (server-side) cursor fetches it in
+pieces. stream_query() uses one and fetchmany() batches whose size adapts to
+what it observes: it aims at TARGET_CHUNK_BYTES of NDJSON per batch, fetched
+in about TARGET_FETCH_SECONDS, so wide rows get small batches, narrow rows
+big ones, and the memory held stays the same whatever the table size.
+Every batch is serialized into one single NDJSON chunk.
+
+The other way around, bulk_load() writes rows with COPY FROM STDIN, fed by a
+file-like object pulling the rows from any iterable (a generator, an NDJSON
+file...), so nothing is held in memory and there's no round trip per row,
+or with execute_values() (1 INSERT per page of rows) as a fallback for where
+COPY isn't allowed.
+
+run from command line against a throwaway database, i.e.:
+    docker run --rm -p 5002:5432 -e POSTGRES_PASSWORD=pass postgres
+    python ndjson_db.py "host=localhost port=5002 user=postgres \
+        password=pass" 'SELECT * FROM "users"'
+"""
+
+import hashlib
+import itertools
+import json
+import resource
+import sys
+import time
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values
+
+COPY_BUFFER_SIZE = 64 * 1024
+MIN_BATCH = 10
+MAX_BATCH = 100_000
+FIRST_BATCH = 1000
+TARGET_CHUNK_BYTES = 256 * 1024
+TARGET_FETCH_SECONDS = 0.05
+USERS_COLUMNS = ("uuid", "first_name", "last_name", "email", "password")
+COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r",
+})
+
+_cursor_ids = itertools.count()
+
+
+class AdaptiveBatch:
+    """fetchmany() size, scaled after every fetch by what it cost"""
+
+    def __init__(self, size=FIRST_BATCH):
+        self.size = size
+
+    def update(self, n_rows, n_bytes, elapsed):
+        if not n_rows:
+            return
+        scale = min(
+            TARGET_CHUNK_BYTES / max(n_bytes, 1),
+            TARGET_FETCH_SECONDS / max(elapsed, 1e-6),
+        )
+        # no more than doubling or halving at once, the 1st batches are noisy
+        scale = min(max(scale, 0.5), 2)
+        self.size = int(min(max(n_rows * scale, MIN_BATCH), MAX_BATCH))
+
+
+def stream_query(conn, query, params=None, batch=None):
+    """
+    Yields the rows of the query as NDJSON chunks, one per fetchmany()
+    batch, the objects keys are the column names.
+    'conn' must be used by nothing else until the stream ends (i.e. checked
+    out of a pool for it): its autocommit is switched off and its
+    transaction rolled back at the end, so a connection already in a
+    transaction is refused with a ProgrammingError
+    """
+    if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        raise psycopg2.ProgrammingError(
+            "stream_query() needs a connection of its own, this one is in "
+            "a transaction"
+        )
+    batch = batch or AdaptiveBatch()
+    dumps = json.JSONEncoder(default=str).encode
+    name = f"ndjson_stream_{next(_cursor_ids)}"
+    # named cursors only live inside a transaction
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        with conn.cursor(name=name) as cursor:
+            cursor.execute(query, params)
+            columns = None
+            while True:
+                t0 = time.perf_counter()
+                rows = cursor.fetchmany(batch.size)
+                elapsed = time.perf_counter() - t0
+                if not rows:
+                    break
+                if columns is None:  # only known after the 1st fetch
+                    columns = [column.name for column in cursor.description]
+                chunk = "".join(
+                    [dumps(dict(zip(columns, row))) + "\n" for row in rows]
+                )
+                batch.update(len(rows), len(chunk), elapsed)
+                yield chunk
+    finally:
+        # nothing to keep, it only ends the transaction holding the cursor,
+        # even if the client went away in the middle of the stream
+        conn.rollback()
+        conn.autocommit = autocommit
+
+
+def random_users(n_rows):
+    """The same rows generate_random_data() of ndjson_basics.py inserts"""
+    for i in range(n_rows):
+        md5 = hashlib.md5(f"{i}".encode()).hexdigest()
+        yield md5, f"f{i}", "l1", "e1@test.com", f"pass{i}"
+
+
+def ndjson_rows(path, columns=USERS_COLUMNS):
+    """Rows out of an NDJSON file, missing keys become NULLs"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(column) for column in columns)
+
+
+class RowsFile:
+    """
+    Read-only file-like object giving the rows in COPY text format, encoded
+    only as copy_expert() asks for more, whatever the number of rows
+    """
+
+    def __init__(self, rows):
+        self.lines = map(self.copy_line, rows)
+        self.buffer = b""
+
+    @staticmethod
+    def copy_line(row):
+        return "\t".join(
+            "\\N" if value is None else str(value).translate(COPY_ESCAPES)
+            for value in row
+        ) + "\n"
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            batch = "".join(itertools.islice(self.lines, 1000))
+            if not batch:
+                break
+            self.buffer += batch.encode()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_rows(cursor, table, columns, rows):
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    cursor.copy_expert(query, RowsFile(rows), size=COPY_BUFFER_SIZE)
+
+
+def insert_values(cursor, table, columns, rows, page_size=1000):
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    execute_values(cursor, query, rows, page_size=page_size)
+
+
+def bulk_load(conn, table, columns, rows, method="copy"):
+    """Loads the rows in one transaction, method: 'copy' or 'values'"""
+    load = copy_rows if method == "copy" else insert_values
+    with conn.cursor() as cursor:
+        load(cursor, table, columns, rows)
+    conn.commit()
+
+
+def main(dsn, query='SELECT * FROM "users"'):
+    conn = psycopg2.connect(dsn)
+    batch = AdaptiveBatch()
+    sizes = set()
+    n_rows = n_chunks = 0
+    t0 = time.time()
+    for chunk in stream_query(conn, query, batch=batch):
+        n_rows += chunk.count("\n")
+        n_chunks += 1
+        sizes.add(batch.size)
+    elapsed = time.time() - t0
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{n_rows} rows in {n_chunks} chunks, {elapsed:.2f}s "
+          f"({n_rows / elapsed:,.0f} rows/s), batches of {min(sizes)} to "
+          f"{max(sizes)} rows, max RSS {max_rss}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,70 @@
+"""
+Rows/s loading users with each of the ways psycopg2 offers, into a temporary
+copy of the 'users' table:
+    - per-row INSERT: 1 execute() (1 round trip) per row, the way
+      generate_random_data() of ndjson_basics.py used to do it
+    - executemany(): the same, but psycopg2 does the loop
+    - execute_values(): 1 INSERT per page of 1000 rows
+    - COPY: 1 single COPY FROM STDIN streaming all the rows
+
+run from command line against a throwaway database, i.e.:
+    python ndjson_db_benchmark.py "host=localhost port=5002 user=postgres \
+        password=pass" [n_rows]
+"""
+
+import sys
+import time
+
+import psycopg2
+
+from ndjson_db import USERS_COLUMNS, bulk_load, random_users
+
+TABLE = "users_benchmark"
+INSERT = (
+    f"INSERT INTO {TABLE} (uuid, first_name, last_name, email, password) "
+    "VALUES (%s, %s, %s, %s, %s)"
+)
+
+
+def per_row_insert(conn, rows):
+    with conn.cursor() as cursor:
+        for row in rows:
+            cursor.execute(INSERT, row)
+    conn.commit()
+
+
+def executemany(conn, rows):
+    with conn.cursor() as cursor:
+        cursor.executemany(INSERT, rows)
+    conn.commit()
+
+
+def execute_values(conn, rows):
+    bulk_load(conn, TABLE, USERS_COLUMNS, rows, method="values")
+
+
+def copy(conn, rows):
+    bulk_load(conn, TABLE, USERS_COLUMNS, rows, method="copy")
+
+
+def main(dsn, n_rows=1_000_000):
+    n_rows = int(n_rows)
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {TABLE} (LIKE users INCLUDING ALL)"
+        )
+    for load in (per_row_insert, executemany, execute_values, copy):
+        with conn.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {TABLE}")
+        conn.commit()
+        t0 = time.time()
+        load(conn, random_users(n_rows))
+        elapsed = time.time() - t0
+        print(f"{load.__name__:>14}: {n_rows} rows in {elapsed:.2f}s "
+              f"({n_rows / elapsed:,.0f} rows/s)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
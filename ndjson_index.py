@@ -0,0 +1,122 @@
+"""
+Random access into NDJSON files: reading "lines 5,000,000-5,001,000" of a
+file means reading (and throwing away) the 5,000,000 lines before them,
+unless we know where each line starts.
+LineIndex builds that once, in one pass, as an array('Q') of line offsets
+saved next to the file (<file>.idx), and on reuse the index is memory mapped
+instead of read, so opening it costs nothing whatever the number of lines.
+The index header keeps the size and mtime of the file, if any of them
+changes, the index is rebuilt. One LineIndex can be shared by the threads of
+a server, a lock keeps them from reading offsets while they're remapped.
+
+    index = LineIndex("data.ndjson")
+    index.read_lines(5_000_000, 1000)  # 1 seek + 1 read
+
+run from command line: python ndjson_index.py ndjson_file [offset] [limit]
+"""
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+HEADER = struct.Struct("<QQ")  # file size, file mtime (ns)
+
+
+class LineIndex:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.stamp = None
+        self.offsets = None  # memoryview of the mapped offsets
+        self._mm = None
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self):
+        with self._lock:
+            self.refresh()
+            return len(self.offsets)
+
+    def _file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def refresh(self):
+        """Maps the index, (re)building it if the file has changed"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp == self.stamp:
+                return
+            self.close()
+            if self._read_stamp() != stamp:
+                self.build(stamp)
+            with open(self.index_path, "rb") as f:
+                self._mm = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            self.offsets = memoryview(self._mm)[HEADER.size:].cast("Q")
+            self.stamp = stamp
+
+    def _read_stamp(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                return HEADER.unpack(f.read(HEADER.size))
+        except (FileNotFoundError, struct.error):
+            return None
+
+    def build(self, stamp):
+        offsets = array("Q")
+        position = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                offsets.append(position)
+                position += len(line)
+        # written aside and renamed, so a reader never maps half an index
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(*stamp))
+            offsets.tofile(f)
+        os.replace(tmp_path, self.index_path)
+
+    def read_lines(self, offset, limit):
+        """Raw bytes of 'limit' lines starting at line 'offset' (0 based)"""
+        with self._lock:
+            self.refresh()
+            n_lines = len(self.offsets)
+            if offset >= n_lines or limit <= 0:
+                return b""
+            start = self.offsets[offset]
+            stop = offset + limit
+            end = None if stop >= n_lines else self.offsets[stop]
+        # the offsets are copied, the file is read out of the lock
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            if end is None:
+                return f.read()
+            return f.read(end - start)
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self.offsets.release()
+                self._mm.close()
+                self.offsets = self._mm = self.stamp = None
+
+
+def main(ndjson_file, offset=0, limit=10):
+    t0 = time.time()
+    index = LineIndex(ndjson_file)
+    print(f"{len(index)} lines indexed in {time.time() - t0:.2f}s")
+    t0 = time.time()
+    page = index.read_lines(int(offset), int(limit))
+    elapsed = time.time() - t0
+    print(page.decode(), end="")
+    print(f"{len(page.splitlines())} lines read in {elapsed:.6f}s")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,157 @@
+"""
+Memory mapped NDJSON scanning: the streaming loop of ndjson_basics.py
+json.loads() every single line just to call line.get("name"), but if the
+bytes '"name"' aren't in the line, the key can't be there either. So here
+the file is mapped in WINDOW_SIZE windows, the keys and the lines around
+them are found with mmap.find() (no copies, no decoding) and only the lines
+that pass that cheap byte level prefilter are decoded.
+Only one window is mapped at a time, otherwise the RSS of a scan would grow
+with the file size, since every page read from a mapped file counts in it.
+
+A key written with escapes (i.e.: "\\u006eame") is missed by the prefilter,
+it's a trade-off for files we write ourselves.
+
+run from command line: python ndjson_mmap.py [ndjson_file or size_mib]
+"""
+
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+import ndjson
+from memory_profiler import memory_usage
+
+WINDOW_SIZE = 16 * 1024 * 1024  # bytes mapped at once
+
+
+def iter_windows(path, window=WINDOW_SIZE):
+    """
+    Yields (mm, start, end): a mapped window of the file and the part of it
+    holding whole lines, the window is only valid until the next one
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = 0  # file offset of the next line
+        while start < size:
+            # mmap offsets must be multiples of the allocation granularity
+            offset = start - start % mmap.ALLOCATIONGRANULARITY
+            length = min(window, size - offset)
+            with mmap.mmap(f.fileno(), length, offset=offset,
+                           access=mmap.ACCESS_READ) as mm:
+                first = start - offset
+                if offset + length == size:
+                    end = length  # the last line may not have a newline
+                else:
+                    end = mm.rfind(b"\n", first) + 1
+                if end > first:
+                    yield mm, first, end
+                    start = offset + end
+                else:  # a line longer than the whole window
+                    window *= 2
+
+
+def iter_spans(path, window=WINDOW_SIZE):
+    """Yields (mm, start, end) for every line"""
+    for mm, pos, end in iter_windows(path, window):
+        while pos < end:
+            newline = mm.find(b"\n", pos, end)
+            if newline == -1:
+                newline = end
+            yield mm, pos, newline
+            pos = newline + 1
+
+
+def iter_lines(path, window=WINDOW_SIZE):
+    """
+    Lines as memoryview slices of the mapped file, no copies, each view is
+    released when the next one is requested, or when the loop is left early
+    (the window can't be unmapped while a view of it is alive)
+    """
+    for mm, start, end in iter_spans(path, window):
+        with memoryview(mm) as view:
+            line = view[start:end]
+            try:
+                yield line
+            finally:
+                line.release()
+
+
+def scan(path, keys, contains=()):
+    """
+    Yields {key: value} for the lines having at least one of the top-level
+    keys, contains: other bytes the line must have to be decoded.
+    Instead of visiting every line, we jump from one occurrence of a key to
+    the next one and only then look for the newlines around it
+    """
+    tokens = [json.dumps(key).encode() for key in keys]  # '"name"'
+    contains = [bytes(c) for c in contains]
+    loads = json.loads
+    for mm, pos, end in iter_windows(path):
+        while pos < end:
+            hits = [mm.find(token, pos, end) for token in tokens]
+            hits = [hit for hit in hits if hit != -1]
+            if not hits:
+                break
+            hit = min(hits)
+            start = mm.rfind(b"\n", pos, hit) + 1 or pos
+            stop = mm.find(b"\n", hit, end)
+            if stop == -1:
+                stop = end
+            pos = stop + 1
+            if not all(mm.find(c, start, stop) != -1 for c in contains):
+                continue
+            record = loads(mm[start:stop].decode())
+            found = {key: record[key] for key in keys if key in record}
+            if found:
+                yield found
+
+
+def generate_sample(size_mib):
+    """Events where only 1 line in 10 has a 'name'"""
+    f = tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False)
+    with f:
+        i = 0
+        while f.tell() < size_mib * 1024 * 1024:
+            event = {"id": i, "type": "click", "x": i % 1920, "y": i % 1080,
+                     "tags": ["a", "b", "c"]}
+            if not i % 10:
+                event["name"] = f"name {i % 10_000}"
+            f.write(json.dumps(event) + "\n")
+            i += 1
+    return f.name
+
+
+def names_ndjson_reader(path):
+    with open(path) as f:
+        return {line.get("name") for line in ndjson.reader(f)} - {None}
+
+
+def names_mmap_scan(path):
+    return {found["name"] for found in scan(path, ["name"])}
+
+
+def main(source="2048"):
+    path = source if os.path.exists(source) else generate_sample(int(source))
+    try:
+        size_mib = os.path.getsize(path) / 2**20
+        print(f"{size_mib:.0f}MiB file")
+        for find_names in (names_ndjson_reader, names_mmap_scan):
+            t0 = time.time()
+            peak, names = memory_usage(
+                (find_names, (path,)), interval=0.05, max_usage=True,
+                retval=True,
+            )
+            elapsed = time.time() - t0
+            print(f"{find_names.__name__}: {len(names)} names in "
+                  f"{elapsed:.2f}s ({size_mib / elapsed:.0f}MiB/s), peak RSS "
+                  f"{peak:.0f}MiB")
+    finally:
+        if path != source:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,147 @@
+"""
+Parallel NDJSON reading: since every line is a whole JSON object, the file
+can be split into byte ranges, each one starting right after a newline, and
+each range parsed by a different process. Each worker 'collect's its records
+into a partial result and the partials are 'merge'd, i.e.: the set of names
+of ndjson_basics.py is collect_names() + set.union.
+
+This lives outside ndjson_basics.py on purpose: the worker processes import
+the module of the functions they run, and ndjson_basics.py reads files and
+connects to the database at import time.
+
+run from command line: python ndjson_parallel.py [ndjson_file] [workers]
+(without a file, a sample one with SAMPLE_LINES lines is generated)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent import futures
+from functools import reduce
+
+import ndjson
+
+SAMPLE_LINES = 1_000_000
+CHUNK_SIZE = 1024 * 1024
+
+
+def split_ranges(path, parts):
+    """(start, end) byte ranges of the file, all of them aligned to lines"""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, bounds[-1]))
+            f.readline()  # moving to the beginning of the next line
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:])
+            if start < end]
+
+
+def iter_range(path, start, end):
+    """Decoded records of the lines in [start, end), read in big chunks"""
+    loads = json.loads
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        pending = b""  # incomplete line left over from the previous chunk
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            *lines, pending = (pending + data).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    # json.loads(bytes) would guess the encoding every time
+                    yield loads(line.decode())
+        if pending.strip():
+            yield loads(pending.decode())
+
+
+def collect_range(path, start, end, collect):
+    """Runs in the workers, returns the partial result and the lines read"""
+    n_lines = 0
+
+    def counted(records):
+        nonlocal n_lines
+        for n_lines, record in enumerate(records, 1):
+            yield record
+
+    return collect(counted(iter_range(path, start, end))), n_lines
+
+
+def read_parallel(path, collect, merge, workers=None):
+    """
+    collect: turns an iterable of records into a partial result
+    merge: combines 2 partial results into one
+    Returns the merged result and the number of lines read
+    """
+    workers = workers or os.cpu_count()
+    ranges = split_ranges(path, workers)
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        to_do = [
+            executor.submit(collect_range, path, start, end, collect)
+            for start, end in ranges
+        ]
+        results = [future.result() for future in to_do]
+    partials = [partial for partial, _ in results]
+    return reduce(merge, partials), sum(n for _, n in results)
+
+
+def collect_names(records):
+    return {record.get("name") for record in records}
+
+
+def generate_sample(n_lines=SAMPLE_LINES):
+    f = tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False)
+    with f:
+        for i in range(n_lines):
+            f.write(json.dumps({
+                "id": i,
+                "name": f"name {i % 10_000}",
+                "email": f"user{i}@test.com",
+                "tags": ["a", "b", "c"],
+            }) + "\n")
+    return f.name
+
+
+def main(ndjson_file=None, workers=None):
+    path = ndjson_file or generate_sample()
+    try:
+        # the single reader loop of ndjson_basics.py
+        t0 = time.time()
+        with open(path) as f:
+            names = set()
+            n_lines = 0
+            for line in ndjson.reader(f):
+                names.add(line.get("name"))
+                n_lines += 1
+        elapsed = time.time() - t0
+        print(f"ndjson.reader: {len(names)} names, {n_lines} lines in "
+              f"{elapsed:.2f}s ({n_lines / elapsed:,.0f} lines/s)")
+
+        max_workers = int(workers or os.cpu_count())
+        n_workers = 1
+        while True:
+            t0 = time.time()
+            names, n_lines = read_parallel(
+                path, collect_names, set.union, n_workers
+            )
+            elapsed = time.time() - t0
+            print(f"{n_workers:>2} workers: {len(names)} names, {n_lines} "
+                  f"lines in {elapsed:.2f}s ({n_lines / elapsed:,.0f} "
+                  f"lines/s)")
+            if n_workers >= max_workers:
+                break
+            n_workers = min(n_workers * 2, max_workers)
+    finally:
+        if not ndjson_file:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,89 @@
+"""
+Production mode for the /stream-ndjson-file endpoint of ndjson_basics.py:
+the file already is NDJSON, so instead of decoding every line and dumping it
+again as its own tiny chunk, the raw bytes are passed through in chunks of
+about CHUNK_SIZE bytes (cut at line boundaries, so every chunk is valid
+NDJSON on its own), optionally gzip compressed on the fly.
+
+run from command line to compare both ways: python ndjson_stream.py
+[ndjson_file]
+"""
+
+import json
+import os
+import sys
+import time
+import zlib
+
+import ndjson
+
+from ndjson_parallel import generate_sample
+
+CHUNK_SIZE = 64 * 1024
+GZIP_WBITS = 31  # zlib with gzip header and trailer
+GZIP_LEVEL = 6
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """Raw chunks of about 'chunk_size' bytes, each one ending a line"""
+    with open(path, "rb") as f:
+        pending = b""  # incomplete line left over from the previous read
+        for block in iter(lambda: f.read(chunk_size), b""):
+            block = pending + block
+            cut = block.rfind(b"\n") + 1
+            if not cut:  # a line longer than the chunk
+                pending = block
+                continue
+            pending = block[cut:]
+            yield block[:cut]
+        if pending:
+            yield pending
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """
+    Compresses the chunks as one gzip stream, flushing after each of them so
+    the client can decompress as the data arrives
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_records(path):
+    """The demo way: one json.dumps() (and one chunk) per record"""
+    with open(path) as f:
+        for line in ndjson.reader(f):
+            yield json.dumps(line) + "\n"
+
+
+def measure(name, chunks, size_mib):
+    t0 = time.time()
+    n_chunks = n_bytes = 0
+    for chunk in chunks:
+        n_chunks += 1
+        n_bytes += len(chunk)
+    elapsed = time.time() - t0
+    print(f"{name:>12}: {size_mib / elapsed:>7.1f}MiB/s, {n_chunks} chunks, "
+          f"{n_bytes / 2**20:.1f}MiB sent")
+
+
+def main(ndjson_file=None):
+    path = ndjson_file or generate_sample()
+    try:
+        size_mib = os.path.getsize(path) / 2**20
+        print(f"{size_mib:.0f}MiB file")
+        measure("per record", iter_records(path), size_mib)
+        measure("raw chunks", iter_chunks(path), size_mib)
+        measure("gzip chunks", gzip_chunks(iter_chunks(path)), size_mib)
+    finally:
+        if not ndjson_file:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
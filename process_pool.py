@@ -0,0 +1,216 @@
+"""
+Reusable pool of pre-forked worker processes: multi_processing.py starts a
+Process per job, paying the start of a process (and an interpreter, with
+'spawn') every time, here the workers are started once and get the tasks by
+batches, so the cost of a dispatch (pickle, queue, wake up) is paid once per
+batch instead of once per task.
+
+Every worker has a queue of its own where the batches are dealt, once it's
+empty the worker steals batches from the queues of the others, so a worker
+which got the slow batches doesn't keep the rest waiting. Workers stream
+the results of every batch as soon as it's done, imap_unordered() yields
+them in that order, map() puts them back in the order of the tasks.
+
+run from command line: python process_pool.py [n_tasks] [workers]
+"""
+
+import os
+import sys
+import time
+from itertools import islice
+from multiprocessing import Pool, Process, Queue
+from queue import Empty
+
+BATCHES_PER_WORKER = 16  # more, smaller batches: more room for stealing
+
+
+class WorkerError(Exception):
+    """A task raised an exception in a worker, it's the __cause__"""
+
+
+def worker_loop(worker_id, queues, results):
+    own = queues[worker_id]
+    others = queues[worker_id + 1:] + queues[:worker_id]
+    while True:
+        # nothing left anywhere, waiting for the next batches
+        batch, stolen = own.get(), False
+        if batch is None:  # our own sentinel
+            return
+        while batch is not None:
+            batch_id, function, items = batch
+            try:
+                outcome = [function(item) for item in items]
+            except Exception as exc:
+                outcome = exc
+            results.put((batch_id, worker_id, stolen, outcome))
+            batch, stolen = steal(own, others)
+        if stolen is None:
+            return
+
+
+def steal(own, others):
+    """
+    The next batch, out of our queue first, then out of the others, returns
+    (None, False) when there's none, (None, None) when closing
+    """
+    try:
+        batch = own.get_nowait()
+        return batch, (None if batch is None else False)
+    except Empty:
+        pass
+    for queue in others:
+        try:
+            batch = queue.get_nowait()
+        except Empty:
+            continue
+        if batch is None:  # that's the sentinel of another worker
+            queue.put(None)
+            return None, False
+        return batch, True
+    return None, False
+
+
+class WorkerPool:
+    """
+    Pool of 'workers' processes, started once, to be closed when done:
+        with WorkerPool() as pool:
+            squares = pool.map(square, range(100_000))
+    'function' must be picklable (defined at module level)
+    """
+
+    def __init__(self, workers=None):
+        self.n_workers = workers or os.cpu_count()
+        self.queues = [Queue() for _ in range(self.n_workers)]
+        self.results = Queue()
+        self.stats = {"batches": 0, "stolen": 0}
+        self.processes = [
+            Process(target=worker_loop, args=(i, self.queues, self.results),
+                    daemon=True)
+            for i in range(self.n_workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def batch_size(self, n_items):
+        return max(1, n_items // (self.n_workers * BATCHES_PER_WORKER))
+
+    def submit_batches(self, function, items, batch_size=None):
+        """Deals the batches to the workers, returns how many were sent"""
+        items = list(items)
+        batch_size = batch_size or self.batch_size(len(items))
+        iterator = iter(items)
+        batch_id = 0
+        while batch := list(islice(iterator, batch_size)):
+            queue = self.queues[batch_id % self.n_workers]
+            queue.put((batch_id, function, batch))
+            batch_id += 1
+        return batch_id
+
+    def imap_unordered(self, function, items, batch_size=None):
+        """
+        Yields (batch_id, results of the batch) as the workers stream them.
+        After a failure (or if the caller stops early) the results of the
+        other batches are still waited for, so they don't get mixed with
+        the next ones, then WorkerError is raised
+        """
+        n_batches = self.submit_batches(function, items, batch_size)
+        received = 0
+        error = None
+        try:
+            while received < n_batches:
+                batch_id, worker_id, stolen, outcome = self.results.get()
+                received += 1
+                self.stats["batches"] += 1
+                self.stats["stolen"] += stolen
+                if isinstance(outcome, Exception):
+                    if error is None:
+                        error = WorkerError(f"worker {worker_id} failed")
+                        error.__cause__ = outcome
+                elif error is None:
+                    yield batch_id, outcome
+        finally:
+            for _ in range(n_batches - received):
+                self.results.get()
+        if error is not None:
+            raise error
+
+    def map(self, function, items, batch_size=None):
+        """The results of function(item) for all the items, in order"""
+        batches = dict(self.imap_unordered(function, items, batch_size))
+        return [result for batch_id in sorted(batches)
+                for result in batches[batch_id]]
+
+    def close(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def tiny_task(x):
+    return x * x
+
+
+def process_per_task(results, x):
+    results.put(tiny_task(x))
+
+
+def run_process_per_task(n_tasks):
+    results = Queue()
+    squares = []
+    for x in range(n_tasks):
+        process = Process(target=process_per_task, args=(results, x))
+        process.start()
+        squares.append(results.get())
+        process.join()
+    return squares
+
+
+def main(n_tasks=100_000, workers=None, n_process_per_task=1000):
+    """
+    Process per task runs n_process_per_task tasks only, its time is
+    scaled to n_tasks
+    """
+    n_tasks, workers = int(n_tasks), int(workers or os.cpu_count())
+    n_process_per_task = min(int(n_process_per_task), n_tasks)
+    expected = [tiny_task(x) for x in range(n_tasks)]
+
+    def report(name, elapsed, n=n_tasks):
+        per_task = elapsed / n
+        print(f"{name:>18}: {per_task * n_tasks:>8.2f}s for {n_tasks} tasks "
+              f"({1 / per_task:,.0f} tasks/s){'' if n == n_tasks else ' *'}")
+
+    t0 = time.perf_counter()
+    squares = run_process_per_task(n_process_per_task)
+    report("Process per task", time.perf_counter() - t0, n_process_per_task)
+    assert squares == expected[:n_process_per_task]
+
+    t0 = time.perf_counter()
+    with Pool(workers) as pool:
+        squares = pool.map(tiny_task, range(n_tasks))
+    report("Pool.map", time.perf_counter() - t0)
+    assert squares == expected
+
+    t0 = time.perf_counter()
+    with WorkerPool(workers) as pool:
+        squares = pool.map(tiny_task, range(n_tasks))
+        report("WorkerPool.map", time.perf_counter() - t0)
+        assert squares == expected
+        # the workers are already there for the next ones
+        t0 = time.perf_counter()
+        squares = pool.map(tiny_task, range(n_tasks))
+        report("WorkerPool.map x2", time.perf_counter() - t0)
+        assert squares == expected
+    print(f"{pool.stats['stolen']}/{pool.stats['batches']} batches stolen")
+    if n_process_per_task < n_tasks:
+        print(f"* measured on {n_process_per_task} tasks")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
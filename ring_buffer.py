@@ -0,0 +1,285 @@
+"""
+Single producer / single consumer channel between processes, for numbers:
+the sender/receiver of multi_processing.py pay 1 pickle and 1 syscall per
+value with Pipe(), here values are copied into fixed-size slots of a ring
+buffer in shared memory, by batches, with nothing in between.
+
+The producer only moves the head (write) index, the consumer only moves the
+tail (read) index, so there's no lock on the way. A side waits on a
+multiprocessing.Condition only when it can't go on (the ring is empty or
+full), setting a flag so the other side knows it has to notify it: no
+busy-spinning, and no syscall as long as neither side waits.
+
+On x86-64, the index (and flag) writes rely on 8 bytes aligned stores being
+atomic and seen in order by the other process, which the platform gives us.
+Elsewhere (i.e. ARM, Apple Silicon) the consumer could see a new head before
+the values it publishes, so the indexes and the FINISHED flag are written
+and read through the lock of the condition (one lock round trip per batch).
+The waits time out every WAKEUP_CHECK seconds, in case a notification is
+lost between a flag and an index update.
+
+run from command line: python ring_buffer.py [n_values]
+"""
+
+import platform
+import sys
+import time
+from array import array
+from multiprocessing import Condition, Pipe, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from random import random
+
+CAPACITY = 64 * 1024  # slots
+BATCH_SIZE = 4096
+WAKEUP_CHECK = 0.1
+# header counters, 8 bytes each and 64 bytes (a cache line) apart, so the
+# producer and the consumer don't write to the same line
+HEAD, TAIL, CONSUMER_WAITING, PRODUCER_WAITING, FINISHED = range(0, 40, 8)
+DATA_OFFSET = 5 * 64
+# stores seen by the other cores in the order they were made
+ORDERED_STORES = platform.machine().lower() in ("x86_64", "amd64")
+
+
+class RingBuffer:
+    """
+    Ring buffer of 'capacity' numbers of an array 'typecode', meant to be
+    given to the producer and consumer processes:
+        ring = RingBuffer()
+        Process(target=produce, args=(ring,)).start()  # ring.put_many(...)
+        while values := ring.get_many():
+            ...
+        ring.close()
+        ring.unlink()
+    """
+
+    def __init__(self, capacity=CAPACITY, typecode="d"):
+        self.capacity = capacity
+        self.typecode = typecode
+        size = DATA_OFFSET + capacity * array(typecode).itemsize
+        self.shm = SharedMemory(create=True, size=size)
+        self.condition = Condition()
+        self._attach()
+
+    def _attach(self):
+        self._counters = self.shm.buf[:DATA_OFFSET].cast("Q")
+        self._slots = self.shm.buf[DATA_OFFSET:].cast(self.typecode)
+
+    def __getstate__(self):
+        # when sent to a spawned process
+        return self.capacity, self.typecode, self.shm.name, self.condition
+
+    def __setstate__(self, state):
+        self.capacity, self.typecode, name, self.condition = state
+        self.shm = SharedMemory(name)
+        self._attach()
+
+    def __len__(self):
+        return self._load(HEAD) - self._load(TAIL)
+
+    def _load(self, index):
+        """Reads a counter written by the other side"""
+        if ORDERED_STORES:
+            return self._counters[index]
+        with self.condition:
+            return self._counters[index]
+
+    def _store(self, index, value):
+        """Publishes a counter to the other side"""
+        if ORDERED_STORES:
+            self._counters[index] = value
+        else:
+            with self.condition:
+                self._counters[index] = value
+
+    def _wait(self, flag, ready):
+        with self.condition:
+            self._counters[flag] = 1
+            try:
+                while not ready():
+                    self.condition.wait(WAKEUP_CHECK)
+            finally:
+                self._counters[flag] = 0
+
+    def _wake(self, flag):
+        if self._counters[flag]:
+            with self.condition:
+                self.condition.notify()
+
+    def put_many(self, values):
+        """Producer side, blocks while the ring is full"""
+        typecode = self.typecode
+        if not (isinstance(values, array) and values.typecode == typecode):
+            values = array(typecode, values)
+        values = memoryview(values)
+        counters, slots, capacity = self._counters, self._slots, self.capacity
+        done, n_values = 0, len(values)
+        while done < n_values:
+            head = counters[HEAD]
+            free = capacity - (head - self._load(TAIL))
+            if not free:
+                self._wait(PRODUCER_WAITING,
+                           lambda: counters[HEAD] - counters[TAIL] < capacity)
+                continue
+            count = min(free, n_values - done)
+            start = head % capacity
+            first = min(count, capacity - start)  # before wrapping around
+            slots[start:start + first] = values[done:done + first]
+            if count > first:
+                slots[:count - first] = values[done + first:done + count]
+            self._store(HEAD, head + count)  # published once copied
+            done += count
+            self._wake(CONSUMER_WAITING)
+
+    def put(self, value):
+        self.put_many((value,))
+
+    def finish(self):
+        """Producer side: no more values, get_many() returns empty arrays"""
+        self._store(FINISHED, 1)
+        self._wake(CONSUMER_WAITING)
+
+    def get_many(self, max_count=None):
+        """
+        Consumer side: an array of the values available, up to 'max_count',
+        blocks while the ring is empty, returns an empty array once the
+        producer has finished and everything was read
+        """
+        counters, capacity = self._counters, self.capacity
+        while True:
+            tail = counters[TAIL]
+            available = self._load(HEAD) - tail
+            if available:
+                break
+            if self._load(FINISHED):
+                # the last values may have been published after our read
+                # of the head, and before the flag
+                if self._load(HEAD) == tail:
+                    return array(self.typecode)
+                continue
+            self._wait(CONSUMER_WAITING,
+                       lambda: counters[HEAD] != counters[TAIL]
+                       or counters[FINISHED])
+        count = min(available, max_count or available)
+        start = tail % capacity
+        first = min(count, capacity - start)
+        slots = self._slots
+        values = array(self.typecode)
+        # frombytes() only takes bytes views, not typed ones
+        values.frombytes(slots[start:start + first].cast("B"))
+        if count > first:
+            values.frombytes(slots[:count - first].cast("B"))
+        self._store(TAIL, tail + count)  # the slots can be reused
+        self._wake(PRODUCER_WAITING)
+        return values
+
+    def get(self):
+        """Consumer side, None once finished"""
+        values = self.get_many(1)
+        return values[0] if values else None
+
+    def close(self):
+        self._counters.release()
+        self._slots.release()
+        self.shm.close()
+
+    def unlink(self):
+        """By the process which created the ring, once done with it"""
+        self.shm.unlink()
+
+
+def random_batches(n_values, batch_size=BATCH_SIZE):
+    for start in range(0, n_values, batch_size):
+        yield [random() for _ in range(min(batch_size, n_values - start))]
+
+
+def send_pipe(connection, n_values):
+    for batch in random_batches(n_values):
+        for value in batch:
+            connection.send(value)
+    connection.send(None)
+
+
+def receive_pipe(connection):
+    count = 0
+    while connection.recv() is not None:
+        count += 1
+    return count
+
+
+def send_queue(queue, n_values):
+    for batch in random_batches(n_values):
+        for value in batch:
+            queue.put(value)
+    queue.put(None)
+
+
+def receive_queue(queue):
+    count = 0
+    while queue.get() is not None:
+        count += 1
+    return count
+
+
+def send_ring(ring, n_values):
+    for batch in random_batches(n_values):
+        ring.put_many(batch)
+    ring.finish()
+
+
+def receive_ring(ring):
+    count = 0
+    while values := ring.get_many():
+        count += len(values)
+    return count
+
+
+def send_ring_one_by_one(ring, n_values):
+    for batch in random_batches(n_values):
+        for value in batch:
+            ring.put(value)
+    ring.finish()
+
+
+def receive_ring_one_by_one(ring):
+    count = 0
+    while ring.get() is not None:
+        count += 1
+    return count
+
+
+def measure(name, send, receive, sender_end, receiver_end, n_values):
+    t0 = time.perf_counter()
+    sender = Process(target=send, args=(sender_end, n_values))
+    sender.start()
+    count = receive(receiver_end)
+    sender.join()
+    elapsed = time.perf_counter() - t0
+    assert count == n_values, count
+    print(f"{name:>16}: {count} values in {elapsed:.2f}s, "
+          f"{count / elapsed:,.0f} messages/s")
+
+
+def main(n_values=10_000_000):
+    n_values = int(n_values)
+    receiver_end, sender_end = Pipe(duplex=False)
+    measure("Pipe", send_pipe, receive_pipe, sender_end, receiver_end,
+            n_values)
+    queue = Queue()
+    measure("Queue", send_queue, receive_queue, queue, queue, n_values)
+    ring = RingBuffer()
+    try:
+        measure("RingBuffer", send_ring, receive_ring, ring, ring, n_values)
+    finally:
+        ring.close()
+        ring.unlink()
+    ring = RingBuffer()
+    try:
+        measure("RingBuffer 1 by 1", send_ring_one_by_one,
+                receive_ring_one_by_one, ring, ring, n_values)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -1,7 +1,15 @@
 import json
+import marshal
+import math
 import pickle
+import struct
+import sys
+import time
+import tracemalloc
+from array import array as typed_array  # "array" is taken below
+from collections import namedtuple
 
-from flask import Flask
+from flask import Flask, Response, request
 
 # basics
 obj = [
@@ -32,7 +40,19 @@ app = Flask(__name__)
 
 @app.route("/")
 def root_endpoint():
-    return json.dumps(obj)
+    # the backend is negotiated (see SERIALIZERS below), JSON by default
+    if "Accept" not in request.headers:
+        serializer = SERIALIZERS["json"]
+    else:
+        media_type = request.accept_mimetypes.best_match(
+            [serializer.media_type for serializer in SERIALIZERS.values()]
+        )
+        if media_type is None:
+            return "Not Acceptable", 406
+        serializer = MEDIA_TYPES[media_type]
+    frames = serializer.dumps(obj)
+    body = pack_frames(frames) if serializer.framed else frames
+    return Response(body, mimetype=serializer.media_type)
 
 
 # be careful when you use a custom encoder!
@@ -40,9 +60,11 @@ class ComplexEncoder(json.JSONEncoder):
     # https://docs.python.org/3/library/json.html
 
     count_instances = 0
+    verbose = True
 
     def __new__(cls, *args, **kwargs):
-        print("instantiating ComplexEncoder")  # you'll see it multiple times
+        if cls.verbose:
+            print("instantiating ComplexEncoder")  # you'll see it many times
         ComplexEncoder.count_instances += 1
         return super().__new__(ComplexEncoder)
 
@@ -65,9 +87,240 @@ for o in array:
     print(serialized3)
 print(f"{ComplexEncoder.count_instances} instances of ComplexEncoder")
 
-# this is a better way:
+# this is a better way: one encoder, built once and reused. Careful, its
+# default() only converts the object to something JSON can encode, encode()
+# is what actually encodes it
 complex_encoder = ComplexEncoder()
 for o in array:
-    serialized4 = complex_encoder.default(o)
+    serialized4 = complex_encoder.encode(o)
     print(serialized4)
 print(f"{ComplexEncoder.count_instances} instances of ComplexEncoder")
+
+
+def dumps(obj):
+    """json.dumps(obj, cls=ComplexEncoder), without a new encoder per call"""
+    return complex_encoder.encode(obj)
+
+
+def dumps_many(objs, separator="\n"):
+    """
+    Encodes all the objects into one single string, one JSON document per
+    object (NDJSON with the default separator).
+    complex numbers skip the encoder: the float repr() is what JSON would
+    write, only NaN and infinities need it
+    """
+    encode = complex_encoder.encode
+    isfinite = math.isfinite
+    parts = []
+    append = parts.append
+    for obj in objs:
+        if (type(obj) is complex and isfinite(obj.real)
+                and isfinite(obj.imag)):
+            append(f"[{obj.real!r}, {obj.imag!r}]")
+        else:
+            append(encode(obj))
+    return separator.join(parts)
+
+
+print(dumps_many(array[:3]))
+print(f"{ComplexEncoder.count_instances} instances of ComplexEncoder")
+
+
+def benchmark(n=1_000_000):
+    """The ways of encoding n complex numbers, to the same output"""
+    values = [complex(i, -i / 3) for i in range(n)]
+    ComplexEncoder.verbose = False
+
+    def per_call():
+        return "\n".join(
+            [json.dumps(value, cls=ComplexEncoder) for value in values]
+        )
+
+    def reused():
+        return "\n".join([dumps(value) for value in values])
+
+    def batched():
+        return dumps_many(values)
+
+    expected = None
+    for encode in (per_call, reused, batched):
+        instances = ComplexEncoder.count_instances
+        t0 = time.perf_counter()
+        output = encode()
+        elapsed = time.perf_counter() - t0
+        expected = expected or output
+        assert output == expected
+        print(f"{encode.__name__:>8}: {elapsed:.2f}s "
+              f"({n / elapsed:,.0f} values/s), "
+              f"{ComplexEncoder.count_instances - instances} encoders")
+
+
+# Pluggable serializers: a registry of backends sharing one interface
+#   frames = serializer.dumps(obj)
+#   obj = serializer.loads(frames)
+# frames being a list of bytes-like objects. There's one for most backends,
+# but pickle protocol 5 keeps the big buffers out of band: they're handed
+# over as they are, next to the pickle, instead of being copied into it.
+# Over the wire, the frames of a 'framed' backend are sent with
+# pack_frames(). Never loads() pickle or marshal data from untrusted sources.
+Serializer = namedtuple("Serializer", "name media_type dumps loads framed")
+SERIALIZERS = {}
+MEDIA_TYPES = {}
+FRAME_LENGTH = struct.Struct(">I")
+
+
+def register(name, media_type, dumps, loads, framed=False):
+    serializer = Serializer(name, media_type, dumps, loads, framed)
+    SERIALIZERS[name] = MEDIA_TYPES[media_type] = serializer
+    return serializer
+
+
+def pack_frames(frames):
+    """Frame count and lengths, then the frames, as a list of parts"""
+    lengths = [memoryview(frame).nbytes for frame in frames]
+    header = struct.pack(f">I{len(lengths)}I", len(lengths), *lengths)
+    return [header, *frames]
+
+
+def unpack_frames(data):
+    """The frames of pack_frames(), as memoryviews of 'data' (no copies)"""
+    data = memoryview(data)
+    (n_frames,) = FRAME_LENGTH.unpack_from(data)
+    lengths = struct.unpack_from(f">{n_frames}I", data, FRAME_LENGTH.size)
+    position = FRAME_LENGTH.size * (n_frames + 1)
+    frames = []
+    for length in lengths:
+        frames.append(data[position:position + length])
+        position += length
+    return frames
+
+
+def pickle5_dumps(obj):
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return [data, *(buffer.raw() for buffer in buffers)]
+
+
+def pickle5_loads(frames):
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+
+register(
+    "json", "application/json",
+    lambda obj: [dumps(obj).encode()],
+    lambda frames: json.loads(b"".join(frames)),
+)
+register(
+    "pickle", "application/x-python-pickle",
+    lambda obj: [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)],
+    lambda frames: pickle.loads(frames[0]),
+)
+register(
+    "pickle5", "application/x-python-pickle5",
+    pickle5_dumps, pickle5_loads, framed=True,
+)
+register(
+    "marshal", "application/x-python-marshal",
+    lambda obj: [marshal.dumps(obj)],
+    lambda frames: marshal.loads(frames[0]),
+)
+
+
+class FloatArray:
+    """
+    array("d") that pickle protocol 5 can send out of band: its buffer goes
+    to the buffer_callback instead of being copied into the pickle.
+    (array itself doesn't support it, numpy arrays do)
+    """
+
+    def __init__(self, values=()):
+        self.values = typed_array("d", values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        return isinstance(other, FloatArray) and self.values == other.values
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return FloatArray.from_buffer, (pickle.PickleBuffer(self.values),)
+        return FloatArray.from_buffer, (self.values.tobytes(),)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        float_array = cls()
+        float_array.values.frombytes(buffer)
+        return float_array
+
+
+def sample_payloads(scale=1):
+    """Realistic payloads, 'scale' times bigger"""
+    n_users = 2_000 * scale
+    n_values = 1_000_000 * scale
+    n_records = 100_000 * scale
+    return {
+        "nested dicts": {
+            f"user{i}": {
+                "id": i,
+                "name": f"name {i}",
+                "address": {"city": "Dublin", "zip": f"D{i % 24:02}",
+                            "geo": {"lat": 53.35 + i / 1e6, "lng": -6.26}},
+                "tags": ["a", "b", "c"],
+                "scores": {"math": i % 100, "art": (i * 7) % 100},
+            }
+            for i in range(n_users)
+        },
+        "float list": [i / 3 for i in range(n_values)],
+        "float array": FloatArray(i / 3 for i in range(n_values)),
+        "small records": [
+            {"id": i, "x": i * 0.5, "ok": bool(i % 2)}
+            for i in range(n_records)
+        ],
+    }
+
+
+def measure(function, *args, repeat=3):
+    """Best time out of 'repeat' runs, then the peak of memory allocated"""
+    elapsed = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function(*args)
+        elapsed.append(time.perf_counter() - t0)
+        del result
+    # separate run, tracemalloc slows allocations down
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(elapsed), peak
+
+
+def benchmark_backends(scale=1):
+    """Size, encode/decode times and memory of every backend and payload"""
+    print(f"{'payload':>14} {'backend':>8} {'size':>10} {'encode':>9} "
+          f"{'decode':>9} {'enc. peak':>10} {'dec. peak':>10}")
+    for payload_name, payload in sample_payloads(scale).items():
+        for name, serializer in SERIALIZERS.items():
+            try:
+                frames, encode_time, encode_peak = measure(
+                    serializer.dumps, payload
+                )
+            except (TypeError, ValueError):
+                print(f"{payload_name:>14} {name:>8} {'unsupported':>10}")
+                continue
+            size = sum(memoryview(frame).nbytes for frame in frames)
+            _, decode_time, decode_peak = measure(serializer.loads, frames)
+            print(f"{payload_name:>14} {name:>8} {size / 2**20:>8.2f}MB "
+                  f"{encode_time * 1000:>7.1f}ms "
+                  f"{decode_time * 1000:>7.1f}ms "
+                  f"{encode_peak / 2**20:>8.2f}MB "
+                  f"{decode_peak / 2**20:>8.2f}MB")
+
+
+if __name__ == "__main__":
+    # python serialization.py [n], or python serialization.py backends [scale]
+    if sys.argv[1:2] == ["backends"]:
+        benchmark_backends(*map(int, sys.argv[2:]))
+    else:
+        benchmark(*map(int, sys.argv[1:]))
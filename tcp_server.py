@@ -5,20 +5,113 @@ A sample TCP Server which translates integer to binary, how it works:
             0b101
         byte?> 9
             0b1001
+
+There's also a pipelined mode for machine clients (python tcp_server.py
+127.0.0.1 2323 pipelined), no prompt is sent and the client can push many
+newline separated integers in one burst:
+    printf '5\n9\n' | nc localhost 2323
+        0b101
+        0b1001
+
+To use all the cores, start N worker processes (python tcp_server.py
+--workers 4), each one binds the same port with SO_REUSEPORT and runs its own
+event loop, the kernel spreads the incoming connections between them.
+
+Machine clients can also talk a binary protocol (python tcp_server.py
+127.0.0.1 2323 auto), the protocol is negotiated from the first byte sent
+after the prompt:
+    - BINARY_FIXED: integers are signed 64 bits little endian
+    - BINARY_VARINT: integers are zigzag LEB128 varints (up to 64 bits)
+    - anything else: the usual telnet text protocol
+Binary requests and replies are frames, a 4 bytes big endian length followed
+by the payload, the reply payload is the binary representations separated by
+b"\n", i.e.: frame([5, 9]) -> frame(b"0b101\n0b1001"). An empty frame ends
+the session, 'binary_frame()' builds the request frames.
+
+Every connection goes through the 'limits' below (see --help): how many
+connections are served at once (the others are refused or queued), how long
+a peer can stay idle or take to finish a query, and how many bytes of replies
+can pile up for a peer that doesn't read them.
+
+Text and pipelined replies come from a bounded LRU cache keyed on the raw
+query bytes (--cache-size), the 'stats' query shows its hits and misses:
+    byte?> stats
+        1 connections, 2 queries, 0 refused, 0 timeouts, cache: 1 hits,
+        1 misses, 1/4096 entries
 """
 
+import argparse
 import asyncio
-import sys
+import functools
+import multiprocessing
+import os
+import queue
+import signal
+import struct
+from collections import Counter
 
 CRLF = b"\r\n"
 PROMPT = b"byte?> "
+NOT_AN_INTEGER = b"doesn't look like an integer :(" + CRLF
+BUFFER_SIZE = 64 * 1024  # max bytes taken from the reader at once
+SHUTDOWN_TIMEOUT = 5  # seconds given to open connections when stopping
+BINARY_FIXED = b"\xb8"
+BINARY_VARINT = b"\xb7"
+FRAME_HEADER = struct.Struct(">I")
+VARINT_MAX_SHIFT = 63  # 10 bytes at most, a 64 bits integer
+FRAME_MAX_SIZE = 16 * 1024 * 1024
+FIXED_INT = struct.Struct("<q")
+BUSY = b"too many connections, try again later" + CRLF
+STATS_QUERY = b"stats"
+CACHE_SIZE = 4096  # replies kept by 'cached_answer()'
 
+# per process counters, each worker has its own copy and reports it back to
+# the parent when shutting down
+stats = Counter()
 
-async def handle_queries(reader, writer):
-    while True:
-        writer.write(PROMPT)
+# per process settings, 'serve()' overrides them with the command line ones
+limits = {
+    "max_connections": 1000,
+    "overflow": "refuse",  # or "queue", waits for a free slot
+    "idle_timeout": 300,  # seconds waiting for the next query
+    "read_timeout": 10,  # seconds to finish a query and to drain its reply
+    "write_buffer": 64 * 1024,  # bytes of replies waiting for a slow peer
+}
+
+
+async def drain(writer):
+    """
+    drain() only blocks above the 'write_buffer' limit, so only then it's
+    worth paying for a timeout (wait_for() spawns a task every call)
+    """
+    if writer.transport.get_write_buffer_size() > limits["write_buffer"]:
+        await asyncio.wait_for(writer.drain(), limits["read_timeout"])
+    else:
         await writer.drain()
-        data = await reader.readline()
+
+
+async def handle_queries(reader, writer, first=b""):
+    """
+    first: byte(s) of the 1st line already read by 'handle_queries_auto',
+    which has also sent the 1st prompt
+    """
+    stats["connections"] += 1
+    while True:
+        if first:
+            data = first
+            if not first.endswith(b"\n"):
+                data += await asyncio.wait_for(
+                    reader.readline(), limits["idle_timeout"]
+                )
+            first = b""
+        else:
+            writer.write(PROMPT)
+            await drain(writer)
+            data = await asyncio.wait_for(
+                reader.readline(), limits["idle_timeout"]
+            )
+        if not data:  # EOF, the peer won't send anything anymore
+            break
         try:
             query = data.decode().strip()
         except UnicodeDecodeError:
@@ -28,35 +121,328 @@ async def handle_queries(reader, writer):
         if query:
             if ord(query[:1]) < 32:
                 break
-            try:
-                byted = bytes(bin(int(query)), encoding="utf8")
-                writer.write(byted + CRLF)
-            except (ValueError, TypeError):
-                writer.write(b"doesn't look like an integer :(" + CRLF)
-                pass
-            await writer.drain()
+            if query == STATS_QUERY.decode():
+                writer.write(stats_reply())
+            else:
+                stats["queries"] += 1
+                writer.write(cached_answer(data.strip()))
+            await drain(writer)
     print("Closed the client socket")
     writer.close()
 
 
-def main(address="127.0.0.1", port=2323):
-    port = int(port)
-    loop = asyncio.get_event_loop()
-    server_coro = asyncio.start_server(
-        handle_queries, address, port, loop=loop
+def answer(query):
+    """
+    Translates one raw query line into its reply, 'int()' accepts bytes
+    directly (surrounding whitespace included), so there's no need to decode
+    and strip the line into a str first
+    """
+    try:
+        return bin(int(query)).encode() + CRLF
+    except ValueError:
+        return NOT_AN_INTEGER
+
+
+# the same few integers are asked over and over, so we keep their ready to
+# send replies (CRLF included) instead of re-running int(), bin() and encode()
+cached_answer = functools.lru_cache(maxsize=CACHE_SIZE)(answer)
+
+
+def set_cache_size(maxsize):
+    global cached_answer
+    cached_answer = functools.lru_cache(maxsize=maxsize)(answer)
+
+
+def stats_reply():
+    cache = cached_answer.cache_info()
+    return "{}, cache: {} hits, {} misses, {}/{} entries".format(
+        format_stats(stats), cache.hits, cache.misses,
+        cache.currsize, cache.maxsize,
+    ).encode() + CRLF
+
+
+async def handle_queries_pipelined(reader, writer):
+    """
+    Same translation as 'handle_queries', but instead of one prompt, one
+    drain and one print per query, we parse every complete line already
+    buffered in the reader and answer all of them with a single
+    'writelines()' + 'drain()'
+    """
+    stats["connections"] += 1
+    pending = b""  # incomplete line left over from the previous read
+    closing = False
+    while not closing:
+        # only a peer in the middle of a line is held to the read timeout
+        timeout = limits["read_timeout" if pending else "idle_timeout"]
+        data = await asyncio.wait_for(reader.read(BUFFER_SIZE), timeout)
+        if not data:  # EOF
+            break
+        *lines, pending = (pending + data).split(b"\n")
+        if len(pending) > BUFFER_SIZE:  # a "line" that never ends
+            lines.append(pending)
+            pending = b""
+        replies = []
+        for line in lines:
+            query = line.strip()
+            if not query:
+                continue
+            if query[0] < 32:  # control chars, i.e.: CTRL+C in telnet
+                closing = True
+                break
+            if query == STATS_QUERY:
+                replies.append(stats_reply())
+                continue
+            stats["queries"] += 1
+            replies.append(cached_answer(query))
+        writer.writelines(replies)
+        await drain(writer)
+    writer.close()
+
+
+def decode_fixed(payload):
+    if len(payload) % FIXED_INT.size:
+        raise ValueError("payload isn't a multiple of 8 bytes")
+    return (n for n, in FIXED_INT.iter_unpack(payload))
+
+
+def decode_varints(payload):
+    n = shift = 0
+    for byte in memoryview(payload):
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:  # more bytes to come
+            shift += 7
+            if shift > VARINT_MAX_SHIFT:
+                # or a frame of 0xFF would cost us quadratic big int shifts
+                raise ValueError("varint too long")
+            continue
+        yield (n >> 1) ^ -(n & 1)  # zigzag: 0, -1, 1, -2... -> 0, 1, 2, 3...
+        n = shift = 0
+    if shift:
+        raise ValueError("truncated varint")
+
+
+def encode_varint(n):
+    n = (n << 1) ^ -(n < 0)  # zigzag
+    encoded = bytearray()
+    while n > 0x7F:
+        encoded.append(n & 0x7F | 0x80)
+        n >>= 7
+    encoded.append(n)
+    return encoded
+
+
+def binary_frame(numbers, varint=False):
+    """Request frame for the binary protocol, the client side of it"""
+    if varint:
+        payload = b"".join(encode_varint(n) for n in numbers)
+    else:
+        payload = struct.pack("<{}q".format(len(numbers)), *numbers)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+DECODERS = {
+    BINARY_FIXED: decode_fixed,
+    BINARY_VARINT: decode_varints,
+}
+
+
+async def handle_queries_binary(reader, writer, magic):
+    """
+    Length prefixed frames in both directions, the integers are taken
+    straight from the bytes (no decode, strip and int(str)) and the whole
+    reply is built in one bytearray, written through a memoryview
+    """
+    stats["connections"] += 1
+    decode = DECODERS[magic]
+    while True:
+        try:
+            header = await asyncio.wait_for(
+                reader.readexactly(FRAME_HEADER.size), limits["idle_timeout"]
+            )
+            (size,) = FRAME_HEADER.unpack(header)
+            if not size or size > FRAME_MAX_SIZE:
+                break
+            payload = await asyncio.wait_for(
+                reader.readexactly(size), limits["read_timeout"]
+            )
+        except asyncio.IncompleteReadError:  # EOF in the middle of a frame
+            break
+        reply = bytearray(FRAME_HEADER.size)
+        try:
+            answers = [bin(n).encode() for n in decode(payload)]
+        except ValueError:  # malformed frame, we can't resync, give up
+            break
+        reply += b"\n".join(answers)
+        FRAME_HEADER.pack_into(reply, 0, len(reply) - FRAME_HEADER.size)
+        stats["queries"] += len(answers)
+        writer.write(memoryview(reply))
+        await drain(writer)
+    writer.close()
+
+
+async def handle_queries_auto(reader, writer):
+    """Telnet users get the text protocol, machine clients can go binary"""
+    writer.write(PROMPT)
+    await drain(writer)
+    first = await asyncio.wait_for(reader.read(1), limits["idle_timeout"])
+    if not first:  # EOF
+        writer.close()
+    elif first in DECODERS:
+        await handle_queries_binary(reader, writer, first)
+    else:
+        await handle_queries(reader, writer, first)
+
+
+HANDLERS = {
+    "text": handle_queries,
+    "pipelined": handle_queries_pipelined,
+    "auto": handle_queries_auto,
+}
+
+
+async def handle_with_limits(handler, slots, reader, writer):
+    """
+    Wraps every handler: bounds the replies buffered for the peer (drain()
+    blocks above it), refuses or queues the connections above
+    'max_connections' and closes the ones which hit a timeout or were reset
+    """
+    writer.transport.set_write_buffer_limits(high=limits["write_buffer"])
+    if slots.locked() and limits["overflow"] == "refuse":
+        stats["refused"] += 1
+        writer.write(BUSY)
+        writer.close()
+        return
+    async with slots:
+        try:
+            await handler(reader, writer)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            writer.close()
+        except ConnectionError:  # reset by the peer, nothing to tell it
+            writer.close()
+
+
+async def serve(address, port, mode="text", reuse_port=False,
+                cache_size=CACHE_SIZE, **options):
+    """
+    Serves until SIGTERM (or the task being cancelled, i.e.: CTRL+C), then
+    stops accepting and gives the open connections SHUTDOWN_TIMEOUT seconds,
+    options: overrides for 'limits'
+    """
+    limits.update(options)
+    if cache_size != cached_answer.cache_info().maxsize:
+        set_cache_size(cache_size)
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(limits["max_connections"])
+    handler = functools.partial(handle_with_limits, HANDLERS[mode], slots)
+    server = await asyncio.start_server(
+        handler, address, port, reuse_port=reuse_port
     )
-    server = loop.run_until_complete(server_coro)
     host = server.sockets[0].getsockname()
-    print("Serving on {}. Hit CTRL-C to stop.".format(host))
+    print("[{}] Serving on {}.".format(os.getpid(), host), flush=True)
+    stop = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
     try:
-        loop.run_forever()
+        await stop
+    finally:
+        server.close()
+        try:
+            await asyncio.wait_for(server.wait_closed(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+
+def format_stats(counters):
+    return "{} connections, {} queries, {} refused, {} timeouts".format(
+        counters["connections"], counters["queries"],
+        counters["refused"], counters["timeouts"],
+    )
+
+
+def worker(address, port, mode, results, options):
+    # CTRL+C reaches the whole process group, only the parent handles it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve(address, port, mode, reuse_port=True, **options))
+    results.put((os.getpid(), stats))
+
+
+def main(address="127.0.0.1", port=2323, mode="text", workers=1, **options):
+    port = int(port)
+    workers = int(workers)
+    if workers > 1:
+        return main_workers(address, port, mode, workers, options)
+    print("Hit CTRL-C to stop.")
+    try:
+        asyncio.run(serve(address, port, mode, **options))
     except KeyboardInterrupt:  # CTRL+C pressed
         pass
     print("Server shutting down.")
-    server.close()
-    loop.run_until_complete(server.wait_closed())
-    loop.close()
+    print(format_stats(stats))
+
+
+def main_workers(address, port, mode, workers, options):
+    # a 'kill <parent pid>' shuts down as gracefully as CTRL+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker, args=(address, port, mode, results, options)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print("{} workers started. Hit CTRL-C to stop.".format(workers))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:  # CTRL+C pressed
+        pass
+    print("Server shutting down.")
+    for process in processes:
+        if process.is_alive():
+            process.terminate()  # SIGTERM, handled by 'serve()'
+    total = Counter()
+    for _ in processes:
+        try:
+            pid, worker_stats = results.get(timeout=SHUTDOWN_TIMEOUT + 1)
+        except queue.Empty:  # a worker died without reporting
+            break
+        print("[{}] {}".format(pid, format_stats(worker_stats)))
+        total.update(worker_stats)
+    for process in processes:
+        process.join()
+    print("total: {}".format(format_stats(total)))
 
 
 if __name__ == "__main__":
-    main(*sys.argv[1:])
+    parser = argparse.ArgumentParser(description="integer to binary server")
+    parser.add_argument("address", nargs="?", default="127.0.0.1")
+    parser.add_argument("port", nargs="?", type=int, default=2323)
+    parser.add_argument("mode", nargs="?", choices=HANDLERS, default="text")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--max-connections", type=int,
+                        default=limits["max_connections"],
+                        help="per process")
+    parser.add_argument("--overflow", choices=("refuse", "queue"),
+                        default=limits["overflow"],
+                        help="what to do with connections above the max")
+    parser.add_argument("--idle-timeout", type=float,
+                        default=limits["idle_timeout"])
+    parser.add_argument("--read-timeout", type=float,
+                        default=limits["read_timeout"])
+    parser.add_argument("--write-buffer", type=int,
+                        default=limits["write_buffer"])
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+                        help="replies kept in the LRU cache")
+    args = parser.parse_args()
+    main(
+        args.address, args.port, args.mode, args.workers,
+        max_connections=args.max_connections,
+        overflow=args.overflow,
+        idle_timeout=args.idle_timeout,
+        read_timeout=args.read_timeout,
+        write_buffer=args.write_buffer,
+        cache_size=args.cache_size,
+    )
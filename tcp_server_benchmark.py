@@ -0,0 +1,151 @@
+"""
+Throughput benchmark for tcp_server.py, both server and client run locally
+in the same event loop, so the numbers are only meaningful relative to each
+other.
+    - text: today's telnet behaviour, one prompt, drain, print and reply per
+      query, so the client has to wait for each answer (one round trip each)
+    - pipelined: the client sends every query in one burst and the server
+      answers whatever is buffered with a single writelines/drain
+    - binary: 'auto' mode negotiated to length prefixed frames of fixed
+      width integers, FRAME_SIZE integers per frame
+
+A check of the varint decoder against a hostile frame, FRAME_MAX_SIZE bytes
+of 0xFF (one endless varint): the server must close the connection at once,
+not spend the event loop on ever bigger integers.
+
+Then a microbenchmark of the reply cache alone, a Zipf distributed workload
+(a few integers asked most of the time) through 'answer()' and
+'cached_answer()', without any network in the way.
+
+run from command line: python tcp_server_benchmark.py [n_queries]
+"""
+
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import time
+
+import tcp_server
+
+ADDRESS = "127.0.0.1"
+FRAME_SIZE = 1000
+ZIPF_DISTINCT = 100_000  # distinct integers in the workload
+ZIPF_EXPONENT = 1.2
+
+
+async def text_client(queries, port):
+    reader, writer = await asyncio.open_connection(ADDRESS, port)
+    for query in queries:
+        writer.write(query + b"\n")
+        # the prompt arrives right before each answer, on the same line
+        await reader.readuntil(tcp_server.CRLF)
+    # a control char ends the session, as telnet users do
+    writer.write(b"\x03\n")
+    await reader.read()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def pipelined_client(queries, port):
+    reader, writer = await asyncio.open_connection(ADDRESS, port)
+    writer.write(b"\n".join(queries) + b"\n")
+    await writer.drain()
+    for _ in queries:
+        await reader.readuntil(tcp_server.CRLF)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def binary_client(queries, port):
+    numbers = [int(query) for query in queries]
+    reader, writer = await asyncio.open_connection(ADDRESS, port)
+    writer.write(tcp_server.BINARY_FIXED)
+    await reader.readexactly(len(tcp_server.PROMPT))
+    for i in range(0, len(numbers), FRAME_SIZE):
+        writer.write(tcp_server.binary_frame(numbers[i:i + FRAME_SIZE]))
+    await writer.drain()
+    for _ in range(0, len(numbers), FRAME_SIZE):
+        header = await reader.readexactly(tcp_server.FRAME_HEADER.size)
+        (size,) = tcp_server.FRAME_HEADER.unpack(header)
+        await reader.readexactly(size)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def varint_bomb_client(queries, port):
+    reader, writer = await asyncio.open_connection(ADDRESS, port)
+    writer.write(tcp_server.BINARY_VARINT)
+    await reader.readexactly(len(tcp_server.PROMPT))
+    payload = b"\xff" * tcp_server.FRAME_MAX_SIZE
+    writer.write(tcp_server.FRAME_HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+    reply = await reader.read()
+    if reply:
+        raise AssertionError(f"{len(reply)} bytes of reply to a bad frame")
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(mode, client, queries):
+    server = await asyncio.start_server(tcp_server.HANDLERS[mode], ADDRESS, 0)
+    port = server.sockets[0].getsockname()[1]
+    t0 = time.perf_counter()
+    await client(queries, port)
+    elapsed = time.perf_counter() - t0
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+def zipf_queries(n_queries):
+    universe = [str(random.randrange(1 << 32)).encode()
+                for _ in range(ZIPF_DISTINCT)]
+    ranks = range(1, ZIPF_DISTINCT + 1)
+    weights = [1 / rank ** ZIPF_EXPONENT for rank in ranks]
+    return random.choices(universe, weights, k=n_queries)
+
+
+def per_query_cost(translate, queries):
+    t0 = time.perf_counter()
+    for query in queries:
+        translate(query)
+    return (time.perf_counter() - t0) / len(queries)
+
+
+def cache_main(n_queries):
+    queries = zipf_queries(n_queries)
+    tcp_server.set_cache_size(tcp_server.CACHE_SIZE)
+    uncached = per_query_cost(tcp_server.answer, queries)
+    cached = per_query_cost(tcp_server.cached_answer, queries)
+    cache = tcp_server.cached_answer.cache_info()
+    print(f"\nZipf(s={ZIPF_EXPONENT}) over {ZIPF_DISTINCT} integers, "
+          f"cache of {cache.maxsize} replies:")
+    print(f" uncached: {uncached * 1e9:.0f}ns per query")
+    print(f"   cached: {cached * 1e9:.0f}ns per query "
+          f"({cache.hits / n_queries:.1%} hits)")
+
+
+def main(n_queries=100_000):
+    n_queries = int(n_queries)
+    queries = [str(random.randrange(1 << 32)).encode()
+               for _ in range(n_queries)]
+    for label, mode, client in (("text", "text", text_client),
+                                ("pipelined", "pipelined", pipelined_client),
+                                ("binary", "auto", binary_client)):
+        # the text handler prints every query, we don't want the terminal
+        # to be the bottleneck
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            elapsed = asyncio.run(run(mode, client, queries))
+        print(f"{label:>9}: {n_queries} queries in {elapsed:.2f}s "
+              f"({n_queries / elapsed:,.0f} queries/s)")
+    elapsed = asyncio.run(run("auto", varint_bomb_client, queries))
+    print(f"varint bomb: {tcp_server.FRAME_MAX_SIZE} bytes of 0xFF rejected "
+          f"in {elapsed:.2f}s")
+    cache_main(n_queries)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
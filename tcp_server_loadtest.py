@@ -0,0 +1,86 @@
+"""
+Load test for tcp_server.py limits: opens up to 10k idle connections against
+a local server, and after every step measures the server's RSS and the
+latency of a query sent on an already open connection. Up to
+'max_connections' the RSS grows a few KiB per connection, after that the
+server refuses the newcomers and both RSS and latency stay flat while the
+idle connections keep piling up on the client side.
+
+run from command line:
+    python tcp_server_loadtest.py [n_connections] [max_connections] [mode]
+
+Every connection is a file descriptor on both sides, raise 'ulimit -n' if
+the connections fail (the server inherits the limit from this script).
+"""
+
+import asyncio
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import psutil  # installed by memory_profiler
+
+import tcp_server
+
+ADDRESS = "127.0.0.1"
+PORT = 2324
+STEP = 1000
+PROBES = 200
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def probe(reader, writer):
+    latencies = []
+    for _ in range(PROBES):
+        t0 = time.perf_counter()
+        writer.write(b"12345\n")
+        await reader.readuntil(tcp_server.CRLF)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    return (statistics.median(latencies),
+            latencies[int(len(latencies) * 0.99) - 1])
+
+
+async def load(server, n_connections):
+    rss = psutil.Process(server.pid)
+    prober = await asyncio.open_connection(ADDRESS, PORT)
+    idle = []
+    print("connections   server RSS   p50 latency   p99 latency")
+    while True:
+        p50, p99 = await probe(*prober)
+        print(f"{len(idle):>11}   {rss.memory_info().rss / 2**20:>7.1f}MiB"
+              f"   {p50 * 1000:>9.3f}ms   {p99 * 1000:>9.3f}ms")
+        if len(idle) >= n_connections:
+            break
+        for _ in range(STEP):
+            idle.append(await asyncio.open_connection(ADDRESS, PORT))
+    for _, writer in idle + [prober]:
+        writer.close()
+
+
+def main(n_connections=10_000, max_connections=1000, mode="pipelined"):
+    n_connections = int(n_connections)
+    if raise_fd_limit() < n_connections + 100:
+        print("warning: 'ulimit -n' may be too low for this test")
+    server = subprocess.Popen(
+        [sys.executable, "tcp_server.py", ADDRESS, str(PORT), mode,
+         "--max-connections", str(max_connections)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(1)  # waiting for the server to start listening
+        asyncio.run(load(server, n_connections))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
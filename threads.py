@@ -8,6 +8,7 @@ For our example, this is a script for downloading stuff, nothing special
 import os
 import sys
 import time
+import uuid
 from concurrent import futures
 
 import requests
@@ -17,6 +18,10 @@ COUNTRY_CODES = (
 ).split()
 BASE_URL = "http://flupy.org/data/flags"  # flags images URL
 DEST_DIR = "/Users/jorgeleyjunior/Downloads/Flags/"  # make sure exists
+CHUNK_SIZE = 64 * 1024  # bytes read and written at once when streaming
+# download_one() streams the flags to disk, False to get each of them in
+# memory first (get_flag() and save_flag()), see threads_memory.py
+STREAMING = True
 
 
 def save_flag(img, filename):
@@ -27,12 +32,46 @@ def save_flag(img, filename):
         # simulate heavy download
 
 
+# no session, timeout nor retry here, see download_engine.py for those
 def get_flag(cc):
     url = "{}/{cc}/{cc}.gif".format(BASE_URL, cc=cc.lower())
     resp = requests.get(url)
     return resp.content
 
 
+def get_flag_stream(cc):
+    """The flag, chunk by chunk as it comes, never all of it in memory"""
+    url = "{}/{cc}/{cc}.gif".format(BASE_URL, cc=cc.lower())
+    with requests.get(url, stream=True) as resp:
+        resp.raise_for_status()
+        yield from resp.iter_content(CHUNK_SIZE)
+
+
+def save_flag_stream(chunks, filename):
+    """
+    Writes the chunks to a temporary file of DEST_DIR, renamed to 'filename'
+    once complete (atomically), so a failed download leaves no partial flag
+    behind. Returns the size of the flag
+    """
+    # not tempfile.mkstemp(), its files are private (0600), the flags get
+    # the default mode (umask) as save_flag() ones
+    tmp_path = os.path.join(
+        DEST_DIR, ".{}.{}.part".format(filename, uuid.uuid4().hex)
+    )
+    size = 0
+    fp = open(tmp_path, "xb")
+    try:
+        with fp:
+            for chunk in chunks:
+                fp.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, os.path.join(DEST_DIR, filename))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return size
+
+
 def show(text):
     print(text, end=" ")
     # this is needed because Python normally waits for a line break to flush
@@ -49,13 +88,18 @@ def simple_sequential_download_many(cc_list):
     return len(cc_list)
 
 
-MAX_WORKERS = 12
+MAX_WORKERS = 12  # adaptive_executor.py finds it for each host instead
 
 
 def download_one(cc):
-    image = get_flag(cc)
-    show(cc)
-    save_flag(image, cc.lower() + ".gif")
+    filename = cc.lower() + ".gif"
+    if STREAMING:
+        save_flag_stream(get_flag_stream(cc), filename)
+        show(cc)
+    else:
+        image = get_flag(cc)
+        show(cc)
+        save_flag(image, filename)
     return cc
 
 
@@ -107,7 +151,18 @@ def thread_download_many_v2(cc_list):
     return len(results)
 
 
-# This IS INDEED truly parallel computation
+def init_process(base_url, dest_dir):
+    """
+    Initializer of the worker processes: they get BASE_URL and DEST_DIR of
+    the parent, the 'spawn' start method (macOS, Windows) re-imports this
+    module, which would reset them to the defaults
+    """
+    global BASE_URL, DEST_DIR
+    BASE_URL, DEST_DIR = base_url, dest_dir
+
+
+# This IS INDEED truly parallel computation (hybrid_executor.py gives every
+# process a shard of the flags and threads to download them)
 def thread_download_many_v3(cc_list):
     """
     In this 3rd version we're running the tasks using real parallel
@@ -116,14 +171,17 @@ def thread_download_many_v3(cc_list):
     :return:
     """
     # 'ProcessPoolExecutor' will launch as many workers as machine CPU cores
-    with futures.ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    with futures.ProcessPoolExecutor(
+        max_workers=MAX_WORKERS, initializer=init_process,
+        initargs=(BASE_URL, DEST_DIR),
+    ) as executor:
         res = executor.map(download_one, sorted(cc_list))
     return len(list(res))
 
 
-def main(download_many):
+def main(download_many, cc_list=COUNTRY_CODES):
     t0 = time.time()
-    count = download_many(COUNTRY_CODES)
+    count = download_many(cc_list)
     elapsed = time.time() - t0
     msg = "\n{} flags downloaded in {:.2f}s"
     print(msg.format(count, elapsed))
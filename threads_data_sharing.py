@@ -1,6 +1,12 @@
 # SuperFastPython.com
 # example benchmark data transfer between threads
-from multiprocessing import set_start_method, Manager
+import pickle
+import sys
+from array import array
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing import set_start_method, Manager  # noqa: F401
+from multiprocessing.shared_memory import SharedMemory
 from time import time
 from multiprocessing.pool import ThreadPool, Pool
 from queue import Queue
@@ -20,8 +26,66 @@ def consumer_task(queue):
     data = queue.get()  # noqa: F841
 
 
+# send any object with pickle protocol 5: its out-of-band buffers are copied
+# into shared memory blocks, only the pickle and the names of the blocks go
+# through the queue. array doesn't hand its buffer out of band by itself
+# (numpy arrays do), wrap it: put_shared(queue, (a.typecode, PickleBuffer(a)))
+def put_shared(queue, obj):
+    blocks = []
+
+    def to_shared_memory(buffer):
+        raw = buffer.raw()
+        block = SharedMemory(create=True, size=max(raw.nbytes, 1))
+        block.buf[:raw.nbytes] = raw
+        blocks.append((block.name, raw.nbytes))
+        block.close()
+        # the consumer owns (and unlinks) it now
+        resource_tracker.unregister(block._name, "shared_memory")
+
+    header = pickle.dumps(obj, protocol=5, buffer_callback=to_shared_memory)
+    queue.put((header, blocks))
+
+
+# receive an object sent by put_shared(), its buffers are views of the shared
+# memory blocks (no copies), only valid inside the 'with' block: views made
+# out of them must be released before leaving it
+@contextmanager
+def get_shared(queue):
+    header, blocks = queue.get()
+    segments = [SharedMemory(name) for name, _ in blocks]
+    for segment in segments:
+        segment.unlink()  # freed once closed by everyone
+    views = [
+        segment.buf[:size] for segment, (_, size) in zip(segments, blocks)
+    ]
+    try:
+        yield pickle.loads(header, buffers=views)
+    finally:
+        for view in views:
+            view.release()
+        for segment in segments:
+            segment.close()
+
+
+# task to generate data and send it to the consumer through shared memory
+def producer_task_shared(queue):
+    # generate data, buffer-backed this time
+    data = array("q", range(1000000))
+    # send the data, its buffer out of band
+    put_shared(queue, (data.typecode, pickle.PickleBuffer(data)))
+
+
+# task to consume data sent from producer through shared memory
+def consumer_task_shared(queue):
+    # retrieve the data
+    with get_shared(queue) as (typecode, buffer):
+        data = buffer.cast(typecode)  # a view of the shared memory
+        data.release()
+
+
 # run a test and time how long it takes
-def test(pool, queue, n_repeats):
+def test(pool, queue, n_repeats, consumer_task=consumer_task,
+         producer_task=producer_task):
     # repeat many times
     for i in range(n_repeats):
         # issue the consumer task
@@ -32,44 +96,62 @@ def test(pool, queue, n_repeats):
         consumer.wait()
 
 
-# entry point
-if __name__ == '__main__':
+# run one of the ways of sharing data, returns how long it took
+def run(mode, n_repeats):
     # record the start time
     time_start = time()
-    n_repeats = 1000
 
     """
     This is a process data sharing mechanism, it will be slowest compared
     to the Thread approach. This happens because transmitting data between
     processes involves SERIALIZATION, TRANSMISSION, and DESERIALIZATION
     of the Python objects.
-    Uncomment the 2 'with' blocks below and comment the ThreadPool one if you
-    want to see the difference
     """
-    # set_start_method('spawn')
-    # with Pool(2) as pool:
-    #     with Manager() as manager:
-    #         queue = manager.Queue()
-    #         test(pool, queue, n_repeats)
+    if mode == "manager":
+        with Pool(2) as pool:
+            with Manager() as manager:
+                queue = manager.Queue()
+                test(pool, queue, n_repeats)
+
+    """
+    The same processes and Manager queue, but the data is buffer-backed and
+    placed in shared memory: only a small handle is serialized, transmitted
+    and deserialized, the consumer maps the data instead of copying it.
+    """
+    if mode == "shared_memory":
+        with Pool(2) as pool:
+            with Manager() as manager:
+                queue = manager.Queue()
+                test(pool, queue, n_repeats, consumer_task_shared,
+                     producer_task_shared)
 
     """
     This is a Thread data sharing mechanism, it will be fastest compared
     to the previous Process approach. This happens because THREADS SHARE
     MEMORY DIRECTLY, no serialization and deserialization is involved.
-    Comment the 'with' block below and uncomment the previous 2 ones if you
-    want to see the difference.
     """
-    with ThreadPool(2) as pool:
-        queue = Queue()
-        test(pool, queue, n_repeats)
+    if mode == "threads":
+        with ThreadPool(2) as pool:
+            queue = Queue()
+            test(pool, queue, n_repeats)
     # record the end time
     time_end = time()
-    # report the total time
-    duration = time_end - time_start
-    print(f'Total Time {duration:.3} seconds')
-    # report estimated time per task
-    per_task = duration / n_repeats
-    print(f'About {per_task:.3} seconds per task')
+    return time_end - time_start
+
+
+# entry point
+# python threads_data_sharing.py [n_repeats] [manager|shared_memory|threads]
+if __name__ == '__main__':
+    n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    modes = sys.argv[2:] or ["manager", "shared_memory", "threads"]
+    # set_start_method('spawn')
+    for mode in modes:
+        duration = run(mode, n_repeats)
+        # report the total time
+        print(f'{mode}: Total Time {duration:.3} seconds')
+        # report estimated time per task
+        per_task = duration / n_repeats
+        print(f'{mode}: About {per_task:.3} seconds per task')
 
 """
 ***** BENCHMARK (MacBook Pro, 6-Core Intel Core i7 2.6 GHz, 16 GB RAM) *******
@@ -79,4 +161,11 @@ if __name__ == '__main__':
 - Thread Data Sharing:
     - Total = 64.1s
     - Per Task = 0.0641s
+***** BENCHMARK (Linux, 1 vCPU, 200 repeats) **********************************
+- Process Data Sharing, Manager queue:
+    - Per Task = 0.234s
+- Process Data Sharing, Manager queue + shared memory:
+    - Per Task = 0.0885s
+- Thread Data Sharing:
+    - Per Task = 0.0515s
 """
\ No newline at end of file